@@ -1,14 +1,18 @@
-import subprocess
 import ipaddress
-import tempfile
+import functools
+import socket
+import struct
 import random
 import os
 import csv
 import json
 from typing import Dict, List, Tuple, Any
 import requests
+import aiohttp
+import asyncio
 import argparse
 import time
+from concurrent.futures import ProcessPoolExecutor
 
 # =====  SETUP =====
 # CONFS
@@ -19,6 +23,7 @@ RULE_SIZES = [10, 100, 500, 1000, 2000, 5000]
 # RULE_SIZES = [10, 100, 500]
 CURL_TIMEOUT = 1
 DELAY_LOG = "delay_pbr.txt"
+LOG_BUFFER_SIZE = 1 << 16
 HTTP_HEADER = "Content-Type=application/json"
 MAX_PROBE_RETRY = 200
 UPSTREAM = "10.0.253.1"
@@ -29,130 +34,126 @@ EXPERIMENT_SEED = 2178133
 
 random.seed(EXPERIMENT_SEED)
 
-all_domains = [
-    f"test{int(i / 256) + 1}-{i % 256}.com" for i in range(1, TOTAL_DOMAINS + 1)
-]
+# read-only pool every rule_count samples from
+all_domains = tuple(
+    f"test{i // 256 + 1}-{i % 256}.com" for i in range(1, TOTAL_DOMAINS + 1)
+)
 rule_map = {}
 
 
-def write_delay_data(rule_count: int, result: List):
-    # check log path
-    fname = DELAY_LOG
-    with open(fname, mode="a", newline="") as f:
-        writer = csv.writer(f)
-        writer.writerow(
-            [
-                f"[{rule_count}]",
-                "run_index",
-                "domain",
-                "responsiveness_s",
-            ]
-        )
-        writer.writerows(result)
+def write_delay_data(writer, rule_count: int, result: List):
+    """
+    Write one [rule_count] section to the delay log, the file itself is
+    opened once by the caller and left to its own buffering
+    """
+    writer.writerow(
+        [
+            f"[{rule_count}]",
+            "run_index",
+            "domain",
+            "responsiveness_s",
+        ]
+    )
+    writer.writerows(result)
 
 
 # ============== FUNCTIONS  =================
+@functools.lru_cache(maxsize=16)
+def _subnet_range(ip: str, prefix_length: int) -> Tuple[int, int]:
+    """
+    First and last address of ip/prefix_length, as integers
+    """
+    network = ipaddress.IPv4Network(f"{ip}/{prefix_length}", strict=False)
+    return int(network.network_address), int(network.broadcast_address)
+
+
 def in_same_subnet(ip1: str, ip2: str, prefix_length=24) -> bool:
     """
     Deciding if ip1 is in ip2/prefix_length
     """
-    # print(f"Deciding if {ip1} and {ip2} are in the same subnet")
-    network = ipaddress.IPv4Network(f"{ip2}/{prefix_length}", strict=False)
-    # print(f"Network is: {network}")
-    return ipaddress.IPv4Address(ip1.strip()) in network
-
+    low, high = _subnet_range(ip2, prefix_length)
+    try:
+        (ip,) = struct.unpack("!I", socket.inet_pton(socket.AF_INET, ip1.strip()))
+    except OSError:
+        raise ValueError(f"{ip1!r} is not a valid IPv4 address")
+    return low <= ip <= high
 
-def run_curl_probe(domain: str, gw: str, debug: bool = False) -> Tuple[bool, str]:
-    # Simulate dynamic rule (you could replace this with iptables/OVS logic)
 
-    # Bash script content
-    bash_script = f"""#!/bin/bash
-    curl -s --max-time 1 --write-out "%{{time_total}}\n%{{http_code}}\n" http://{domain}
-    echo $?
+async def run_curl_probe(
+    session: aiohttp.ClientSession, domain: str, gw: str, debug: bool = False
+) -> Tuple[bool, str]:
+    """
+    Probe http://[domain] over the given session.
+    The echo server replies with the client ip it sees, which tells
+    which gateway the request went through.
     """
-
     if debug:
         print(f"Testing domain: {domain}, with gw: {gw}")
 
-    # Write to temporary file
-    with tempfile.NamedTemporaryFile(mode="w", delete=False, suffix=".sh") as f:
-        f.write(bash_script)
-        temp_script_path = f.name
-
-    # Make it executable
-    os.chmod(temp_script_path, 0o755)
-
-    # Run it using subprocess
-    result = subprocess.run(
-        [temp_script_path], capture_output=True, text=True, timeout=2
-    )
-
-    output = result.stdout.strip()
-
-    # Output results
-    if debug:
-        print(output)
-
     success = False
     delay = ""
     try:
-        (ip, delay, http_code, exit_code) = output.rsplit("\n", 3)
+        start = time.perf_counter_ns()
+        async with session.get(TARGET_TEMPLATE.format(domain)) as resp:
+            body = await resp.text()
+        elapsed = (time.perf_counter_ns() - start) / 1e9
+
+        ip = body.strip()
         if debug:
             print(
-                f"target: {domain}, ip: {ip}, delay: {delay}, http_code:{http_code}, exit_code: {exit_code}"
+                f"target: {domain}, ip: {ip}, delay: {elapsed:.6f}, http_code:{resp.status}"
             )
-        if in_same_subnet(ip, gw, 24) and int(http_code) == 200:
-            success, delay = True, delay
-        else:
-            success, delay = False, ""
+        if in_same_subnet(ip, gw, 24) and resp.status == 200:
+            success, delay = True, f"{elapsed:.6f}"
 
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        print(f"probe failed: {e!r}\n{domain}")
     except ValueError as e:
-        print(f"having problem parsing output: {e}\n{domain}:{output}")
-    # Clean up
-    os.remove(temp_script_path)
+        print(f"having problem parsing output: {e}\n{domain}")
 
     return success, delay
 
 
+async def run_probes(targets: List, gw: str) -> List[Tuple[bool, str]]:
+    """
+    Fan out one probe per target concurrently, results keep the order of targets
+    """
+    # each name goes through dnsmasq once per run, repeated picks of the
+    # same domain reuse the answer for as long as the session lives
+    connector = aiohttp.TCPConnector(
+        limit=len(targets), use_dns_cache=True, ttl_dns_cache=None
+    )
+    timeout = aiohttp.ClientTimeout(total=CURL_TIMEOUT)
+    async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+        probes = [run_curl_probe(session, target, gw, False) for target in targets]
+        return await asyncio.gather(*probes)
+
+
 def generate_dnsmasq_ipset_conf(domains: List, ipset_name: str):
     """
     Generate ipset = /domain/[ipset] rules.
     Directly output it to a conf file
     """
     rule_size = len(domains)
-    lines = [
-        "no-resolv",
-        f"server={UPSTREAM}#{PORT}",
-        "listen-address=10.0.0.254",
-        "port=53",
-    ]
-    for d in domains:
-        lines.append(f"ipset=/{d}/{ipset_name}")
-    content = "\n".join(lines)
+    header = b"no-resolv\nserver=%s#%d\nlisten-address=10.0.0.254\nport=53" % (
+        UPSTREAM.encode(),
+        PORT,
+    )
+    suffix = f"/{ipset_name}".encode()
+    # every rule line carries its own leading newline, so the file
+    # ends without one, same as before
+    chunks = [header]
+    chunks.extend(b"\nipset=/" + d.encode() + suffix for d in domains)
 
-    with open(f"./confs/conf_{rule_size}.conf", "w") as f:
-        f.write(content)
+    with open(f"./confs/conf_{rule_size}.conf", "wb") as f:
+        f.writelines(chunks)
 
 
-def get_unique_test_domains(samples: List, num: int) -> List:
+def start_dnsmasq(rule_count: int, pid: str) -> int:
     """
-    Returns [num] number of domains from samples
+    Start dnsmasq inside the namespace of [pid], returns the exit code of
+    the launcher (dnsmasq daemonizes itself)
     """
-    used_domains = set()
-    domains = []
-    for i in range(1, num + 1):
-        while True:
-            domain = random.choice(samples)
-            if domain in used_domains:
-                continue
-            else:
-                used_domains.add(domain)
-                domains.append(domain)
-                break
-    return domains
-
-
-def start_dnsmasq(rule_count: int, pid: str):
     cmd = [
         "sudo",
         "-E",
@@ -163,44 +164,51 @@ def start_dnsmasq(rule_count: int, pid: str):
         "--conf-file=confs/conf_{}.conf".format(rule_count),
     ]
 
-    result = subprocess.run(cmd)
+    # posix_spawn skips the fork + fd close sweep that subprocess goes through
+    child = os.posix_spawnp(cmd[0], cmd, os.environ)
+    _, status = os.waitpid(child, 0)
+    return os.waitstatus_to_exitcode(status)
 
 
 # ===  EXPERIMENT LOOP ===
-def run(rule_count: int, pid: str):
-    samples = random.sample(all_domains, rule_count)
-
-    # get the domains sets chosen for this rule count
-    test_domains = get_unique_test_domains(samples, rule_count)
+def run(rule_count: int, pid: str, writer):
+    # get the domains sets chosen for this rule count, already unique
+    test_domains = random.sample(all_domains, rule_count)
 
     # rule_map = {}
 
     # generate the file
     generate_dnsmasq_ipset_conf(test_domains, "isp1")
     start_dnsmasq(rule_count, pid)
-    # print result
-    result = []
     gw = "192.168.1.1"
     # print("============= Overall Delay Results ==============")
-    for run_index in range(1, REPS_PER_SCALE + 1):
-        # === 1. probing
-        target = random.choice(test_domains)
-
-        success, delay = run_curl_probe(target, gw, False)
+    # === 1. probing, all repetitions at once
+    targets = [random.choice(test_domains) for _ in range(REPS_PER_SCALE)]
+    probes = asyncio.run(run_probes(targets, gw))
 
-        result.append([run_index, target, delay.strip()])
+    # one row per repetition, filled in place
+    result = [None] * REPS_PER_SCALE
+    for i, (target, (success, delay)) in enumerate(zip(targets, probes)):
+        result[i] = (i + 1, target, delay)
 
     # write to file
-    write_delay_data(rule_count, result)
+    write_delay_data(writer, rule_count, result)
 
-    result = []
+
+def gen_one_conf(rule_count: int):
+    """
+    Generate the conf for one rule size, seeded per size so the output does not
+    depend on which worker runs it or in which order
+    """
+    rng = random.Random(EXPERIMENT_SEED ^ rule_count)
+    test_domains = rng.sample(all_domains, rule_count)
+    generate_dnsmasq_ipset_conf(test_domains, "isp1")
 
 
 def gen_conf():
-    for n in RULE_SIZES:
-        samples = random.sample(all_domains, n)
-        test_domains = get_unique_test_domains(samples, n)
-        generate_dnsmasq_ipset_conf(test_domains, "isp1")
+    workers = min(len(RULE_SIZES), os.cpu_count() or 1)
+    with ProcessPoolExecutor(max_workers=workers) as ex:
+        list(ex.map(gen_one_conf, RULE_SIZES))
 
 
 if __name__ == "__main__":
@@ -214,6 +222,7 @@ if __name__ == "__main__":
     if args.gen:
         gen_conf()
     elif args.rules and args.pid:
-        run(args.rules, args.pid)
+        with open(DELAY_LOG, mode="a", newline="", buffering=LOG_BUFFER_SIZE) as f:
+            run(args.rules, args.pid, csv.writer(f))
     else:
         print("Missing argument...")
@@ -1,73 +1,69 @@
+import io
 import re
 import numpy as np
+import pandas as pd
 import matplotlib.pyplot as plt
 import argparse
 
+# "[size],run_index,domain,<value>" header line that opens each section
+SECTION_HEADER = re.compile(r"^\[(\d+)\][^\n]*\n?", re.MULTILINE)
+
 
 def parse_file(filename):
     data = {}
     with open(filename) as f:
-        rule_size = None
-        for line in f:
-            line = line.strip()
-            match = re.match(r"\[(\d+)\]", line)
-            if match:
-                rule_size = int(match.group(1))
-                data[rule_size] = []
-            elif (
-                "," in line
-                and rule_size is not None
-                and not line.startswith("run_index")
-            ):
-                parts = line.split(",")
-                try:
-                    value = float(parts[-1])
-                    data[rule_size].append(value)
-                except ValueError:
-                    pass
+        content = f.read()
+    # sections: ['', '10', '1,test35-27.com,0.182436\n...', '100', ...]
+    sections = SECTION_HEADER.split(content)
+    for size, block in zip(sections[1::2], sections[2::2]):
+        if not block.strip():
+            data[int(size)] = []
+            continue
+        # value is always the last column, failed probes leave it empty
+        df = pd.read_csv(io.StringIO(block), header=None)
+        values = pd.to_numeric(df.iloc[:, -1], errors="coerce").dropna()
+        data[int(size)] = values.to_numpy()
     return data
 
 
-def remove_outliers(arr, thresh=2):
-    arr = np.array(arr)
+def inlier_mask(arr, thresh=2):
+    arr = np.asarray(arr)
     mean = np.mean(arr)
     std = np.std(arr)
     if std == 0:
-        return arr
-    filtered = arr[np.abs(arr - mean) <= thresh * std]
-    return filtered
+        return np.ones(arr.shape, dtype=bool)
+    return np.abs(arr - mean) <= thresh * std
 
 
-def mean_std(arr):
-    return np.mean(arr), np.std(arr)
+def summary(data, rule_sizes):
+    """
+    mean and std of every rule size in one groupby, outliers removed
+    """
+    counts = [len(data[rs]) for rs in rule_sizes]
+    values = [np.asarray(data[rs], dtype=float) for rs in rule_sizes]
+    df = pd.DataFrame(
+        {"size": np.repeat(rule_sizes, counts), "val": np.concatenate(values)}
+    )
+    keep = df.groupby("size")["val"].transform(inlier_mask).astype(bool)
+    grouped = df[keep].groupby("size")["val"]
+    return grouped.mean().reindex(rule_sizes), grouped.std(ddof=0).reindex(rule_sizes)
 
 
 def plot(data1, data2, output):
     # For plotting, get sorted rule sizes that appear in both files
     rule_sizes = sorted(set(data1.keys()) & set(data2.keys()))
-    means1, stds1 = [], []
-    means2, stds2 = [], []
     label1 = "Latency (SND)"
     label2 = "Latency (PBR)"
-    table_data = []
-
-    for rs in rule_sizes:
-        # arr1, arr2 = np.array(data1[rs]), np.array(data2[rs])
-        arr1, arr2 = remove_outliers(data1[rs]), remove_outliers(data2[rs])
-        m1, s1 = mean_std(arr1)
-        m2, s2 = mean_std(arr2)
-        # convert to ms
-        means1.append(m1 * 1000)
-        stds1.append(s1 * 1000)
-        means2.append(m2 * 1000)
-        stds2.append(s2 * 1000)
-        table_data.append(
-            [
-                rs,
-                f"{m1 * 1000:.2f} ± {s1 * 1000:.2f}",
-                f"{m2 * 1000:.2f} ± {s2 * 1000:.2f}",
-            ]
-        )
+
+    # convert to ms
+    m1, s1 = (x * 1000 for x in summary(data1, rule_sizes))
+    m2, s2 = (x * 1000 for x in summary(data2, rule_sizes))
+    means1, stds1 = m1.tolist(), s1.tolist()
+    means2, stds2 = m2.tolist(), s2.tolist()
+    table_data = [
+        [rs, f"{m1[rs]:.2f} ± {s1[rs]:.2f}", f"{m2[rs]:.2f} ± {s2[rs]:.2f}"]
+        for rs in rule_sizes
+    ]
 
     plt.figure(figsize=(10, 6))
     plt.errorbar(rule_sizes, means1, yerr=stds1, fmt="o-", capsize=4, label=label1)
@@ -1,5 +1,9 @@
 import sys
 import os
+import matplotlib
+
+# only ever saved to file, no need to bring up a gui backend
+matplotlib.use("Agg")
 import matplotlib.pyplot as plt
 import numpy as np
 import argparse
@@ -7,26 +11,11 @@ import seaborn as sns
 
 
 def parse_file(filename: str):
-    times = []
-    cpus = []
-    memories = []
-    with open(filename, "r") as f:
-        for line in f:
-            line = line.strip()
-            # Skip header or empty lines
-            if not line or line.startswith("Elapsed") or line.startswith("-"):
-                continue
-            # Split on whitespace and only take first three columns
-            cols = line.split()
-            if len(cols) < 3:
-                continue
-            try:
-                times.append(float(cols[0]))
-                cpus.append(float(cols[1]))
-                memories.append(float(cols[2]))
-            except ValueError:
-                continue
-    return np.array(times), np.array(cpus), np.array(memories)
+    # psrecord header is commented out with "#", only take first three columns
+    times, cpus, memories = np.loadtxt(
+        filename, comments="#", usecols=(0, 1, 2), ndmin=2, unpack=True
+    )
+    return times, cpus, memories
 
 
 # Use command line or hardcode your files here
@@ -52,43 +41,35 @@ output_file = args.output
 colors = sns.color_palette("colorblind", 6)
 
 
-# global min/max
-cpus_all = []
-mems_all = []
-
 fig, ax1 = plt.subplots(figsize=(14, 7))
 ax2 = ax1.twinx()
+ax1.set_prop_cycle(color=colors)
+ax2.set_prop_cycle(color=colors)
+
+parsed = [parse_file(fname) for fname in files]
+names = [os.path.basename(fname) for fname in files]
+
+# one plot call per axis, file i takes the i-th color of the cycle
+# Plot CPU (%), dashed line
+cpu_lines = ax1.plot(
+    *[arr for times, cpus, _ in parsed for arr in (times, cpus)],
+    linestyle="--",
+    linewidth=2,
+)
+# Plot Real (MB), solid line
+mem_lines = ax2.plot(
+    *[arr for times, _, mems in parsed for arr in (times, mems)],
+    linestyle="-",
+    linewidth=2,
+)
 
 lines = []
 labels = []
-
-for i, fname in enumerate(files):
-    times, cpus, mems = parse_file(fname)
-    color = colors[i % len(colors)]
-
-    cpus_all.extend(cpus)
-    mems_all.extend(mems)
-
-    # Plot CPU (%), dashed line
-    (l1,) = ax1.plot(
-        times,
-        cpus,
-        linestyle="--",
-        color=color,
-        label=f"CPU {os.path.basename(fname)}",
-        linewidth=2,
-    )
-    # Plot Real (MB), solid line
-    (l2,) = ax2.plot(
-        times,
-        mems,
-        linestyle="-",
-        color=color,
-        label=f"Mem {os.path.basename(fname)}",
-        linewidth=2,
-    )
+for l1, l2, name in zip(cpu_lines, mem_lines, names):
+    l1.set_label(f"CPU {name}")
+    l2.set_label(f"Mem {name}")
     lines.extend([l1, l2])
-    labels.extend([f"CPU {os.path.basename(fname)}", f"Mem {os.path.basename(fname)}"])
+    labels.extend([f"CPU {name}", f"Mem {name}"])
 
 ax1.set_xlabel("Elapsed Time (s)")
 ax1.set_ylabel("CPU (%)", color="tab:blue")
@@ -1,3 +1,4 @@
+import io
 import re
 import numpy as np
 import matplotlib.pyplot as plt
@@ -13,75 +14,54 @@ def parse_file(filename):
     # Split by [size]
     sections = re.split(r"\[(\d+)\],", content)
     # sections: ['', '10', 'run_index,...\n10,test13-167.com,...', '100', ...]
-    for i in range(1, len(sections), 2):
-        size = int(sections[i])
-        block = sections[i + 1].strip()
-        lines = block.split("\n")
-        if not lines:
-            continue
-        header = lines[0].split(",")
-        # Find columns
-        try:
-            idx_overall = header.index("overall_delay")
-            idx_api = header.index("api_delay")
-            idx_policy = header.index("policy_delay")
-        except ValueError:
+    cols = ["overall_delay", "api_delay", "policy_delay"]
+    for size, block in zip(sections[1::2], sections[2::2]):
+        df = pd.read_csv(io.StringIO(block))
+        if not set(cols).issubset(df.columns):
             continue  # skip if bad header
-        # Collect values
-        ovals, apvals, pvals = [], [], []
-        for line in lines[1:]:
-            parts = line.split(",")
-            try:
-                overall = (
-                    float(parts[idx_overall].replace(".", "0.", 1))
-                    if parts[idx_overall].startswith(".")
-                    else float(parts[idx_overall])
-                )
-                api = float(parts[idx_api])
-                policy = float(parts[idx_policy])
-            except Exception:
-                continue
-            ovals.append(overall * 1000)
-            apvals.append(api * 1000)
-            pvals.append(policy * 1000)
-        data[size] = {
-            "overall_delay": np.array(ovals),
-            "api_delay": np.array(apvals),
-            "policy_delay": np.array(pvals),
-        }
+        # rows with any unparsable value are dropped, as a whole
+        values = df[cols].apply(pd.to_numeric, errors="coerce").dropna()
+        data[int(size)] = {col: values[col].to_numpy() * 1000 for col in cols}
     return data
 
 
-def remove_outliers(arr):
-    arr = np.array(arr)
-    q1 = np.percentile(arr, 25)
-    q3 = np.percentile(arr, 75)
+DELAY_COLS = ["overall_delay", "api_delay", "policy_delay"]
+
+
+def inlier_mask(arr):
+    arr = np.asarray(arr, dtype=np.float64)
+    # both quartiles from a single partition of the data
+    q1, q3 = np.percentile(arr, [25, 75])
     iqr = q3 - q1
     lower = q1 - 1.5 * iqr
     upper = q3 + 1.5 * iqr
-    filtered = arr[(arr >= lower) & (arr <= upper)]
-    return filtered
+    return (arr >= lower) & (arr <= upper)
+
+
+def to_frame(data):
+    # one row per run: size, overall_delay, api_delay, policy_delay
+    return pd.concat(
+        [pd.DataFrame(data[size]).assign(size=size) for size in sorted(data.keys())],
+        ignore_index=True,
+    )
 
 
 def summary_stats(data):
     # data: {size: {'overall_delay': arr, ...}}
-    means, stds = {}, {}
-    for size in sorted(data.keys()):
-        means[size] = {}
-        stds[size] = {}
-        for key in ["overall_delay", "api_delay", "policy_delay"]:
-            filtered = remove_outliers(data[size][key])
-            means[size][key] = np.round(filtered.mean(), 1)
-            stds[size][key] = np.round(filtered.std(), 1)
-        # Calculate residuals per run
-        filtered_overall = remove_outliers(data[size]["overall_delay"])
-        filtered_api = remove_outliers(data[size]["api_delay"])
-        filtered_policy = remove_outliers(data[size]["policy_delay"])
-        # To ensure matching lengths (after outlier removal), take intersection
-        n = min(len(filtered_overall), len(filtered_api), len(filtered_policy))
-        residuals = filtered_overall[:n] - (filtered_api[:n] + filtered_policy[:n])
-        means[size]["residual_delay"] = np.round(residuals.mean(), 1)
-        stds[size]["residual_delay"] = np.round(residuals.std(), 1)
+    df = to_frame(data)
+    # outliers are dropped per size and per column, in one pass
+    keep = df.groupby("size")[DELAY_COLS].transform(inlier_mask)
+    filtered = df[DELAY_COLS].where(keep)
+    # residual of each run, NaN unless all three of its delays are inliers
+    filtered["residual_delay"] = (
+        filtered["overall_delay"] - filtered["api_delay"] - filtered["policy_delay"]
+    )
+    grouped = filtered.groupby(df["size"])
+    mean_df = grouped.mean().round(1)
+    std_df = grouped.std(ddof=0).round(1)
+
+    means = {size: mean_df.loc[size].to_dict() for size in mean_df.index}
+    stds = {size: std_df.loc[size].to_dict() for size in std_df.index}
     return means, stds
 
 
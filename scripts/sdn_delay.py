@@ -1,14 +1,15 @@
 import subprocess
-import ipaddress
-import tempfile
+import socket
 import random
-import os
 import csv
 import json
 from typing import Dict, List, Tuple, Any
 import requests
+from requests.adapters import HTTPAdapter
 import argparse
 import time
+import itertools
+import string
 
 # =====  SETUP =====
 # CONFS
@@ -19,6 +20,7 @@ REPS_PER_SCALE = 10
 RULE_SIZES = [10, 100, 500, 1000, 5000]
 # RULE_SIZES = [10, 100, 500]
 PROBE_INTERVAL = 0.005
+CURL_TIMEOUT = 1
 DELAY_LOG = "delay.txt"
 HTTP_HEADER = "Content-Type=application/json"
 MAX_PROBE_RETRY = 200
@@ -28,9 +30,46 @@ EXPERIMENT_SEED = 2178133
 
 random.seed(EXPERIMENT_SEED)
 
-all_domains = [
-    f"test{int(i / 256) + 1}-{i % 256}.com" for i in range(1, TOTAL_DOMAINS + 1)
-]
+# read-only pool every rule_count samples from
+all_domains = tuple(
+    f"test{i // 256 + 1}-{i % 256}.com" for i in range(1, TOTAL_DOMAINS + 1)
+)
+
+# one pooled keep-alive session shared by every probe and api call
+SESSION = requests.Session()
+SESSION.mount("http://", HTTPAdapter(pool_connections=32, pool_maxsize=32))
+
+# probe-and-change script, shared by both flip directions. [negate] is "!"
+# when waiting for the domain to become unreachable
+_PROBE_TPL = string.Template(
+    """#!/bin/bash
+
+function probe() {
+    max_count=$max_count
+    count=0
+    # microsecond integers, so timing needs no date or bc forks
+    start_time=$${EPOCHREALTIME/./}
+    while ((count<max_count)); do
+        if $negate ping -c1 -D -W 0.5 $domain >>result.log; then
+            end_time=$${EPOCHREALTIME/./}
+            break
+        fi
+        sleep $interval
+        ((count++))
+    done
+    elapsed=$$((end_time - start_time))
+    printf '%d.%06d\\n' $$((elapsed / 1000000)) $$((elapsed % 1000000))
+}
+
+function change() {
+    curl -s --max-time 1 --write-out "\\n%{time_total}\\n" -X POST -H "$header" -d '$data_json' $url
+}
+
+probe &
+change &
+wait
+"""
+)
 
 
 def write_delay_data(rule_count: int, result: List):
@@ -50,63 +89,52 @@ def write_delay_data(rule_count: int, result: List):
 
 
 # ============== FUNCTIONS  =================
+# netmask of each prefix length seen so far, as an integer
+_NETMASKS: Dict[int, int] = {}
+
+
+def _ipv4_to_int(ip: str) -> int:
+    try:
+        return int.from_bytes(socket.inet_pton(socket.AF_INET, ip.strip()), "big")
+    except OSError:
+        raise ValueError(f"{ip!r} is not a valid IPv4 address")
+
+
 def in_same_subnet(ip1: str, ip2: str, prefix_length=24) -> bool:
     """
     Deciding if ip1 is in ip2/prefix_length
     """
-    # print(f"Deciding if {ip1} and {ip2} are in the same subnet")
-    network = ipaddress.IPv4Network(f"{ip2}/{prefix_length}", strict=False)
-    # print(f"Network is: {network}")
-    return ipaddress.IPv4Address(ip1.strip()) in network
+    mask = _NETMASKS.get(prefix_length)
+    if mask is None:
+        mask = (0xFFFFFFFF << (32 - prefix_length)) & 0xFFFFFFFF
+        _NETMASKS[prefix_length] = mask
+    return _ipv4_to_int(ip1) & mask == _ipv4_to_int(ip2) & mask
 
 
 def run_curl_probe(domain: str, rule: Dict, debug: bool = False) -> Tuple[bool, str]:
-    # Simulate dynamic rule (you could replace this with iptables/OVS logic)
-
-    # Bash script content
-    bash_script = f"""#!/bin/bash
-    curl -s --max-time 1 --write-out "%{{time_total}}\n%{{http_code}}\n" http://{domain}
-    echo $?
     """
-
-    # if debug:
-    #     print(f"Testing domain: {domain}, with rule: {rule}")
-
-    # Write to temporary file
-    with tempfile.NamedTemporaryFile(mode="w", delete=False, suffix=".sh") as f:
-        f.write(bash_script)
-        temp_script_path = f.name
-
-    # Make it executable
-    os.chmod(temp_script_path, 0o755)
-
-    # Run it using subprocess
-    result = subprocess.run(
-        [temp_script_path], capture_output=True, text=True, timeout=1
-    )
-
-    output = result.stdout.strip()
-
-    # Output results
-    if debug:
-        print(output)
-
+    Probe http://[domain] in-process over the shared session.
+    The echo server replies with the client ip it sees, which tells
+    which gateway the request went through.
+    """
     success = False
     delay = ""
     try:
-        (ip, delay, http_code, exit_code) = output.rsplit("\n", 3)
+        start = time.perf_counter_ns()
+        resp = SESSION.get(TARGET_TEMPLATE.format(domain), timeout=CURL_TIMEOUT)
+        elapsed = (time.perf_counter_ns() - start) / 1e9
+
+        ip = resp.text.strip()
         if debug:
             print(
-                f"target: {domain}, ip: {ip}, delay: {delay}, http_code:{http_code}, exit_code: {exit_code}"
+                f"target: {domain}, ip: {ip}, delay: {elapsed:.6f}, http_code:{resp.status_code}"
             )
-        if in_same_subnet(ip, rule.get("route", ""), 24) and int(http_code) == 200:
-            success, delay = True, delay
-        else:
-            success, delay = False, ""
+        if in_same_subnet(ip, rule.get("route", ""), 24) and resp.status_code == 200:
+            success, delay = True, f"{elapsed:.6f}"
+    except requests.RequestException as e:
+        print(f"probe failed: {e}\n{domain}")
     except ValueError as e:
-        print(f"having problem parsing output: {e}\n{output}")
-    # Clean up
-    os.remove(temp_script_path)
+        print(f"having problem parsing output: {e}\n{domain}")
 
     return success, delay
 
@@ -120,85 +148,30 @@ def run_policy_change_and_probe(
     if debug:
         print(f"Running probe and change to domain: {domain}, rule: {rule}")
 
-    bash_script = ""
-    # prepare the
     if "route" in rule:
-        # curl to change the rule
-        # "-H",
-        # "Content-Type: application/json",
-        # "-d",
-        # data,
+        # route -> block, wait for the domain to become unreachable
         data = {"domain": domain, "directive": "block", "value": ""}
-        data_json = json.dumps(data)
-
-        bash_script = f"""#!/bin/bash
-
-        function probe() {{
-            max_count={MAX_PROBE_RETRY}
-            count=0
-            start_time=$(date +%s.%N)
-            while ((count<max_count)); do
-                if ! ping -c1 -D -W 0.5 {domain} >>result.log; then
-                    end_time=$(date +%s.%N)
-                    break
-                fi
-                sleep {PROBE_INTERVAL}
-                ((count++))
-            done
-            echo "$(echo "($end_time - $start_time)" | bc)"
-        }}
-
-        function change() {{
-            curl -s --max-time 1 --write-out "\\n%{{time_total}}\\n" -X POST -H "{HTTP_HEADER}" -d '{data_json}' {POLICY_ENGINE_URL}
-        }}
-
-        probe &
-        change &
-        wait
-        """
-
+        negate = "!"
     elif "block" in rule:
-        # curl to change the rule
+        # block -> route, wait for the domain to become reachable
         data = {"domain": domain, "directive": "route", "value": "192.168.1.1"}
-        data_json = json.dumps(data)
-
-        bash_script = f"""#!/bin/bash
-
-        function probe() {{
-            max_count={MAX_PROBE_RETRY}
-            count=0
-            start_time=$(date +%s.%N)
-            while ((count<max_count)); do
-                if ping -c1 -D -W 0.5 {domain} >>result.log; then
-                    end_time=$(date +%s.%N)
-                    break
-                fi
-                sleep {PROBE_INTERVAL}
-                ((count++))
-            done
-            echo "$(echo "($end_time - $start_time)" | bc)"
-        }}
-
-        function change() {{
-            curl -s --max-time 1 --write-out "\\n%{{time_total}}\\n" -X POST -H "{HTTP_HEADER}" -d '{data_json}' {POLICY_ENGINE_URL}
-        }}
-
-        probe &
-        change &
-        wait
-        """
-    if not bash_script:
+        negate = ""
+    else:
         return False, "", "", ""
-    # Write to temporary file
-    with tempfile.NamedTemporaryFile(mode="w", delete=False, suffix=".sh") as f:
-        f.write(bash_script)
-        temp_script_path = f.name
 
-    # Make it executable
-    os.chmod(temp_script_path, 0o755)
-
-    # Run it using subprocess
-    result = subprocess.run([temp_script_path], capture_output=True, text=True)
+    bash_script = _PROBE_TPL.substitute(
+        max_count=MAX_PROBE_RETRY,
+        negate=negate,
+        domain=domain,
+        interval=PROBE_INTERVAL,
+        header=HTTP_HEADER,
+        data_json=json.dumps(data),
+        url=POLICY_ENGINE_URL,
+    )
+    # feed the script to bash on stdin, nothing touches the disk
+    result = subprocess.run(
+        ["/bin/bash", "-s"], input=bash_script, capture_output=True, text=True
+    )
 
     output = result.stdout.strip()
 
@@ -225,42 +198,20 @@ def run_policy_change_and_probe(
         print("error: failed to parse response")
         success = False
 
-    # Clean up
-    os.remove(temp_script_path)
-
     # return success, delay
     return success, resp_delay, api_delay, policy_delay
 
 
-def get_unique_test_domains(samples, num) -> List:
-    """
-    Returns [num] number of domains from samples
-    """
-    used_domains = set()
-    domains = []
-    for i in range(1, num + 1):
-        while True:
-            domain = random.choice(samples)
-            if domain in used_domains:
-                continue
-            else:
-                used_domains.add(domain)
-                domains.append(domain)
-                break
-    return domains
-
-
 def batch_adding_rules(test_domains: List, rule_map: Dict, debug: bool = False):
     """
     Odd numbers will be block, and even numbers will be route
     """
-    upstreams = ["192.168.1.1", "192.168.2.1"]
-    gw_index = 0
+    # route rules take the upstreams in turn
+    gateways = itertools.cycle(["192.168.1.1", "192.168.2.1"])
     rules = []
     for i, domain in enumerate(test_domains):
-        rule = {"domain": domain, "route": upstreams[gw_index], "dbr": True}
+        rule = {"domain": domain, "route": next(gateways), "dbr": True}
         rules.append(rule)
-        gw_index = ~gw_index
         rule_map[domain] = rule
 
     data = {"rules": rules}
@@ -271,7 +222,7 @@ def batch_adding_rules(test_domains: List, rule_map: Dict, debug: bool = False):
             print(r)
 
     # batch_adding_rules
-    resp = requests.post(f"{POLICY_ENGINE_URL}/batch", json=data)
+    resp = SESSION.post(f"{POLICY_ENGINE_URL}/batch", json=data)
 
     if debug:
         print(f"Got response: {resp.json()}")
@@ -279,10 +230,8 @@ def batch_adding_rules(test_domains: List, rule_map: Dict, debug: bool = False):
 
 # ===  EXPERIMENT LOOP ===
 def run(rule_count: int):
-    samples = random.sample(all_domains, rule_count)
-
-    # get the domains sets chosen for this rule count
-    test_domains = get_unique_test_domains(samples, rule_count)
+    # get the domains sets chosen for this rule count, already unique
+    test_domains = random.sample(all_domains, rule_count)
 
     rule_map = {}
 
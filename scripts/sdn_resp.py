@@ -1,13 +1,16 @@
-import subprocess
-import ipaddress
-import tempfile
 import random
-import os
 import csv
-import json
-from typing import Dict, List, Tuple, Any
+import orjson
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple, Any
 import requests
+from requests.adapters import HTTPAdapter
 import argparse
+import socket
+import time
+import itertools
+import asyncio
+import aiohttp
+import icmplib
 
 # =====  SETUP =====
 # CONFS
@@ -21,17 +24,25 @@ PROBE_INTERVAL = 0.02
 CURL_TIMEOUT = 1
 # DELAY_LOG = "delay.txt"
 RESPONSE_LOG = "response.txt"
+LOG_BUFFER_SIZE = 1 << 16
 HTTP_HEADER = "Content-Type=application/json"
+JSON_HEADERS = {"Content-Type": "application/json"}
 MAX_PROBE_RETRY = 200
+PROBE_TIMEOUT = 0.5
 
 EXPERIMENT_SEED = 2178133
 
 
 random.seed(EXPERIMENT_SEED)
 
-all_domains = [
-    f"test{int(i / 256) + 1}-{i % 256}.com" for i in range(1, TOTAL_DOMAINS + 1)
-]
+# read-only pool every rule_count samples from
+all_domains = tuple(
+    f"test{i // 256 + 1}-{i % 256}.com" for i in range(1, TOTAL_DOMAINS + 1)
+)
+
+# one pooled keep-alive session shared by every probe and api call
+SESSION = requests.Session()
+SESSION.mount("http://", HTTPAdapter(pool_connections=32, pool_maxsize=32))
 
 
 # def write_delay_data(rule_count: int, result: List):
@@ -50,10 +61,15 @@ all_domains = [
 #         writer.writerows(result)
 
 
-def write_response_data(rule_count: int, result: List):
-    # check log path
+def write_response_data(rule_count: int, columns: Tuple[List, ...]):
+    """
+    Append one [rule_count] section to the response log in a single buffered
+    write. [columns] holds one list per csv column, rows are zipped back
+    together here. The header row is kept per section on purpose,
+    plot_resp.py splits the file on it.
+    """
     fname = RESPONSE_LOG.format(rule_count)
-    with open(fname, mode="a", newline="") as f:
+    with open(fname, mode="a", newline="", buffering=LOG_BUFFER_SIZE) as f:
         writer = csv.writer(f)
         writer.writerow(
             [
@@ -65,259 +81,254 @@ def write_response_data(rule_count: int, result: List):
                 "policy_delay",
             ]
         )
-        writer.writerows(result)
+        writer.writerows(zip(*columns))
 
 
 # ============== FUNCTIONS  =================
-def in_same_subnet(ip1: str, ip2: str, prefix_length=24) -> bool:
+# directive a rule holds -> (directive it flips to, its value, reachable after)
+RULE_FLIPS = {
+    "route": ("block", "", False),
+    "block": ("route", "192.168.1.1", True),
+}
+
+
+def flip_of(rule: Dict) -> Optional[Tuple[str, str, bool]]:
     """
-    Deciding if ip1 is in ip2/prefix_length
+    Look up how [rule] flips, None if it is neither a route nor a block rule
     """
-    # print(f"Deciding if {ip1} and {ip2} are in the same subnet")
-    network = ipaddress.IPv4Network(f"{ip2}/{prefix_length}", strict=False)
-    # print(f"Network is: {network}")
-    return ipaddress.IPv4Address(ip1.strip()) in network
+    for directive, flip in RULE_FLIPS.items():
+        if directive in rule:
+            return flip
+    return None
 
 
-def run_curl_probe(domain: str, rule: Dict, debug: bool = False) -> Tuple[bool, str]:
-    # Simulate dynamic rule (you could replace this with iptables/OVS logic)
+# netmask of each prefix length seen so far, as an integer
+_NETMASKS: Dict[int, int] = {}
 
-    # Bash script content
-    bash_script = f"""#!/bin/bash
-    curl -s --max-time 1 --write-out "%{{time_total}}\n%{{http_code}}\n" http://{domain}
-    echo $?
-    """
-
-    if debug:
-        print(f"Testing domain: {domain}, with rule: {rule}")
 
-    # Write to temporary file
-    with tempfile.NamedTemporaryFile(mode="w", delete=False, suffix=".sh") as f:
-        f.write(bash_script)
-        temp_script_path = f.name
+def _ipv4_to_int(ip: str) -> int:
+    try:
+        return int.from_bytes(socket.inet_pton(socket.AF_INET, ip.strip()), "big")
+    except OSError:
+        raise ValueError(f"{ip!r} is not a valid IPv4 address")
 
-    # Make it executable
-    os.chmod(temp_script_path, 0o755)
 
-    # Run it using subprocess
-    result = subprocess.run(
-        [temp_script_path], capture_output=True, text=True, timeout=2
-    )
+def in_same_subnet(ip1: str, ip2: str, prefix_length=24) -> bool:
+    """
+    Deciding if ip1 is in ip2/prefix_length
+    """
+    mask = _NETMASKS.get(prefix_length)
+    if mask is None:
+        mask = (0xFFFFFFFF << (32 - prefix_length)) & 0xFFFFFFFF
+        _NETMASKS[prefix_length] = mask
+    return _ipv4_to_int(ip1) & mask == _ipv4_to_int(ip2) & mask
 
-    output = result.stdout.strip()
 
-    # Output results
+def run_curl_probe(domain: str, rule: Dict, debug: bool = False) -> Tuple[bool, str]:
+    """
+    Probe http://[domain] in-process over the shared session.
+    A route rule is verified by the client ip the echo server sends back,
+    a block rule by the name failing to resolve (curl's exit code 6).
+    """
     if debug:
-        print(output)
+        print(f"Testing domain: {domain}, with rule: {rule}")
 
     success = False
     delay = ""
     try:
         if "route" in rule:
-            (ip, delay, http_code, exit_code) = output.rsplit("\n", 3)
+            start = time.perf_counter_ns()
+            resp = SESSION.get(TARGET_TEMPLATE.format(domain), timeout=CURL_TIMEOUT)
+            elapsed = (time.perf_counter_ns() - start) / 1e9
+
+            ip = resp.text.strip()
             if debug:
                 print(
-                    f"target: {domain}, ip: {ip}, delay: {delay}, http_code:{http_code}, exit_code: {exit_code}"
+                    f"target: {domain}, ip: {ip}, delay: {elapsed:.6f}, http_code:{resp.status_code}"
                 )
-            if in_same_subnet(ip, rule.get("route", ""), 24) and int(http_code) == 200:
-                success, delay = True, delay
-            else:
-                success, delay = False, ""
+            if (
+                in_same_subnet(ip, rule.get("route", ""), 24)
+                and resp.status_code == 200
+            ):
+                success, delay = True, f"{elapsed:.6f}"
 
         elif "block" in rule:
-            delay, _, exit_code = output.rsplit("\n", 2)
+            start = time.perf_counter_ns()
+            try:
+                socket.gethostbyname(domain)
+            except socket.gaierror:
+                success, delay = True, f"{(time.perf_counter_ns() - start) / 1e9:.6f}"
             if debug:
-                print(f"exit_code: {exit_code}")
-            if int(exit_code) == 6:
-                success, delay = True, delay
-            else:
-                success, delay = False, ""
+                print(f"target: {domain}, blocked: {success}")
 
+    except requests.RequestException as e:
+        print(f"probe failed: {e}\n{domain}")
     except ValueError as e:
-        print(f"having problem parsing output: {e}\n{output}")
-    # Clean up
-    os.remove(temp_script_path)
-
+        print(f"having problem parsing output: {e}\n{domain}")
     return success, delay
 
 
-### TODO: directly use a file ?
-def run_policy_change_and_probe(
-    domain: str, rule: Dict, debug: bool = False
-) -> Tuple[bool, str, str, str]:
-    # Simulate dynamic rule (you could replace this with iptables/OVS logic)
-    #
-    if debug:
-        print(f"Running probe and change to domain: {domain}, rule: {rule}")
+async def is_reachable(domain: str) -> bool:
+    """
+    One reachability check: the name has to resolve and the target has to
+    answer a single echo request
+    """
+    try:
+        host = await icmplib.async_ping(domain, count=1, timeout=PROBE_TIMEOUT)
+    except icmplib.NameLookupError:
+        return False
+    return host.is_alive
 
-    bash_script = ""
-    # prepare the
-    if "route" in rule:
-        # curl to change the rule
-        # "-H",
-        # "Content-Type: application/json",
-        # "-d",
-        # data,
-        data = {"domain": domain, "directive": "block", "value": ""}
-        data_json = json.dumps(data)
-
-        bash_script = f"""#!/bin/bash
-
-        function probe() {{
-            max_count={MAX_PROBE_RETRY}
-            count=0
-            start_time=$(date +%s.%N)
-            while ((count<max_count)); do
-                if ! ping -c1 -D -W 0.5 {domain} >>result.log; then
-                    end_time=$(date +%s.%N)
-                    break
-                fi
-                sleep {PROBE_INTERVAL}
-                ((count++))
-            done
-            echo "$(echo "($end_time - $start_time)" | bc)"
-        }}
-
-        function change() {{
-            curl -s --max-time 1 --write-out "\\n%{{time_total}}\\n" -X POST -H "{HTTP_HEADER}" -d '{data_json}' {POLICY_ENGINE_URL}
-        }}
-
-        probe &
-        change &
-        wait
-        """
-
-    elif "block" in rule:
-        # curl to change the rule
-        data = {"domain": domain, "directive": "route", "value": "192.168.1.1"}
-        data_json = json.dumps(data)
-
-        bash_script = f"""#!/bin/bash
-
-        function probe() {{
-            max_count={MAX_PROBE_RETRY}
-            count=0
-            start_time=$(date +%s.%N)
-            while ((count<max_count)); do
-                if ping -c1 -D -W 0.5 {domain} >>result.log; then
-                    end_time=$(date +%s.%N)
-                    break
-                fi
-                sleep {PROBE_INTERVAL}
-                ((count++))
-            done
-            echo "$(echo "($end_time - $start_time)" | bc)"
-        }}
-
-        function change() {{
-            curl -s --max-time 1 --write-out "\\n%{{time_total}}\\n" -X POST -H "{HTTP_HEADER}" -d '{data_json}' {POLICY_ENGINE_URL}
-        }}
-
-        probe &
-        change &
-        wait
-        """
-    if not bash_script:
-        return False, "", "", ""
-    # Write to temporary file
-    with tempfile.NamedTemporaryFile(mode="w", delete=False, suffix=".sh") as f:
-        f.write(bash_script)
-        temp_script_path = f.name
 
-    # Make it executable
-    os.chmod(temp_script_path, 0o755)
+async def probe_until(domain: str, reachable: bool) -> str:
+    """
+    Poll [domain] until its reachability becomes [reachable], returns the
+    time it took, or "" if it never did within MAX_PROBE_RETRY polls
+    """
+    start = time.perf_counter_ns()
+    for _ in range(MAX_PROBE_RETRY):
+        if await is_reachable(domain) == reachable:
+            return f"{(time.perf_counter_ns() - start) / 1e9:.6f}"
+        await asyncio.sleep(PROBE_INTERVAL)
+    return ""
+
 
-    # Run it using subprocess
-    result = subprocess.run([temp_script_path], capture_output=True, text=True)
+async def change_policy(
+    session: aiohttp.ClientSession, data: Dict
+) -> Tuple[Dict, str]:
+    """
+    Post a rule change to the policy engine, returns its reply and the
+    round trip time
+    """
+    start = time.perf_counter_ns()
+    async with session.post(
+        POLICY_ENGINE_URL, data=orjson.dumps(data), headers=JSON_HEADERS
+    ) as resp:
+        body = orjson.loads(await resp.read())
+    elapsed = (time.perf_counter_ns() - start) / 1e9
+    return body, f"{elapsed:.6f}"
 
-    output = result.stdout.strip()
 
-    # Output results
+async def run_policy_change_and_probe(
+    session: aiohttp.ClientSession, domain: str, rule: Dict, debug: bool = False
+) -> Tuple[bool, str, str, str]:
+    """
+    Flip the rule of [domain] and, at the same time, probe until the
+    forwarding plane reflects the change
+    """
     if debug:
-        print(output)
+        print(f"Running probe and change to domain: {domain}, rule: {rule}")
 
-    success = True
-    resp_delay = ""
-    api_delay = ""
-    policy_delay = ""
+    flip = flip_of(rule)
+    if flip is None:
+        return False, "", "", ""
+    directive, value, reachable = flip
+    data = {"domain": domain, "directive": directive, "value": value}
+
+    # probing starts first, the change is posted on the same loop
+    probe = asyncio.ensure_future(probe_until(domain, reachable))
+    try:
+        api_resp, policy_delay = await change_policy(session, data)
+    except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+        print(f"error: policy change failed: {e}")
+        return False, await probe, "", ""
+    resp_delay = await probe
 
-    (api_resp, policy_delay, resp_delay) = output.rsplit("\n", 2)
     if debug:
         print(
             f"resp_delay: {resp_delay}, api_delay:{api_resp}, policy_delay: {policy_delay}"
         )
 
-    # parse api response
-    r = json.loads(api_resp)
-    api_delay = r.get("elapsed")
-
+    success = True
+    api_delay = api_resp.get("elapsed")
     if not api_delay:
         print("error: failed to parse response")
         success = False
 
-    # Clean up
-    os.remove(temp_script_path)
-
-    # return success, delay
     return success, resp_delay, api_delay, policy_delay
 
 
-def get_unique_test_domains(samples, num) -> List:
+def iter_batch_body(rules: Iterable[Dict]) -> Iterator[bytes]:
     """
-    Returns [num] number of domains from samples
+    Yield the /batch request body a rule at a time, so the payload is never
+    held in memory in one piece
     """
-    used_domains = set()
-    domains = []
-    for i in range(1, num + 1):
-        while True:
-            domain = random.choice(samples)
-            if domain in used_domains:
-                continue
-            else:
-                used_domains.add(domain)
-                domains.append(domain)
-                break
-    return domains
+    yield b'{"rules":['
+    sep = b""
+    for rule in rules:
+        yield sep + orjson.dumps(rule)
+        sep = b","
+    yield b"]}"
 
 
 def batch_adding_rules(test_domains: List, rule_map: Dict, debug: bool = False):
     """
     Odd numbers will be block, and even numbers will be route
     """
-    upstreams = ["192.168.1.1", "192.168.2.1"]
-    gw_index = 0
-    rules = []
+    # route rules take the upstreams in turn
+    gateways = itertools.cycle(["192.168.1.1", "192.168.2.1"])
     for i, domain in enumerate(test_domains):
         if i % 2 == 0:
-            rule = {"domain": domain, "route": upstreams[gw_index], "dbr": True}
-            rules.append(rule)
-            gw_index = ~gw_index
-            rule_map[domain] = rule
+            rule = {"domain": domain, "route": next(gateways), "dbr": True}
         else:
             rule = {"domain": domain, "block": "", "dbr": True}
-            rules.append(rule)
-            rule_map[domain] = rule
-
-    data = {"rules": rules}
+        rule_map[domain] = rule
 
     if debug:
         print("requestdata: ")
-        for r in rules:
-            print(r)
+        for domain in test_domains:
+            print(rule_map[domain])
 
-    # batch_adding_rules
-    resp = requests.post(f"{POLICY_ENGINE_URL}/batch", json=data)
+    rules = (rule_map[domain] for domain in test_domains)
+
+    # batch_adding_rules, sent chunked as the body is generated
+    resp = SESSION.post(
+        f"{POLICY_ENGINE_URL}/batch", data=iter_batch_body(rules), headers=JSON_HEADERS
+    )
 
     if debug:
-        print(f"Got response: {resp.json()}")
+        print(f"Got response: {orjson.loads(resp.content)}")
 
 
 # ===  EXPERIMENT LOOP ===
-def run(rule_count: int):
-    samples = random.sample(all_domains, rule_count)
+async def change_and_probe_all(
+    test_domains: List, rule_map: Dict
+) -> Tuple[List, List, List, List, List]:
+    """
+    Run every rep on one event loop and one keep-alive session. Reps stay
+    sequential: overlapping changes would load the policy engine while it
+    is being timed, and could flip the same domain twice at once
+    """
+    run_idxs, targets, overall_delays, api_delays, policy_delays = [], [], [], [], []
+    timeout = aiohttp.ClientTimeout(total=CURL_TIMEOUT)
+    async with aiohttp.ClientSession(timeout=timeout) as session:
+        # distinct targets, so no rep flips a domain an earlier rep flipped
+        chosen = random.sample(test_domains, REPS_PER_SCALE)
+        for run_index, target in enumerate(chosen, start=1):
+            # current rule is known locally, no need to ask the policy engine
+            rule = rule_map[target]
+            # probing is done concurrently with changing policy
+            (
+                success,
+                overall_delay,
+                api_delay,
+                policy_delay,
+            ) = await run_policy_change_and_probe(session, target, rule, True)
+            # keep the local copy in step with the rule that was just posted
+            if success:
+                directive, value, _ = flip_of(rule)
+                rule_map[target] = {"domain": target, directive: value, "dbr": True}
+            run_idxs.append(run_index)
+            targets.append(target)
+            overall_delays.append(overall_delay)
+            api_delays.append(api_delay)
+            policy_delays.append(policy_delay)
+    return run_idxs, targets, overall_delays, api_delays, policy_delays
 
-    # get the domains sets chosen for this rule count
-    test_domains = get_unique_test_domains(samples, rule_count)
+
+def run(rule_count: int):
+    # get the domains sets chosen for this rule count, already unique
+    test_domains = random.sample(all_domains, rule_count)
 
     rule_map = {}
 
@@ -326,7 +337,6 @@ def run(rule_count: int):
     # print(rule_map)
 
     # print result
-    result = []
     # print("============= Overall Delay Results ==============")
     # for run_index in range(1, REPS_PER_SCALE + 1):
     #     # === 1. probing
@@ -342,24 +352,9 @@ def run(rule_count: int):
     # # write to file
     # write_delay_data(rule_count, result)
 
-    result = []
-
-    for run_index in range(1, REPS_PER_SCALE + 1):
-        target = random.choice(test_domains)
-
-        # retrieve the current rule first
-        url = f"{POLICY_ENGINE_URL}/{target}"
-        resp = requests.get(url)
-        rule = resp.json()
-        # rule = rule_map.get(target, "")
-        # generate a bash script and run it, in this script,
-        # probing is done immediately after changing policy
-        success, overall_delay, api_delay, policy_delay = run_policy_change_and_probe(
-            target, rule, True
-        )
-        result.append([run_index, target, overall_delay, api_delay, policy_delay])
+    columns = asyncio.run(change_and_probe_all(test_domains, rule_map))
 
-    write_response_data(rule_count, result)
+    write_response_data(rule_count, columns)
 
 
 if __name__ == "__main__":
@@ -3,17 +3,21 @@ SDN Agent that listens for http requests
 to manage routes
 """
 
-import json
 import logging
-
-# import aiofiles
+import logging.handlers
+import queue
+import atexit
+import os
 import asyncio
 import ipaddress
+import functools
 from typing import Dict, List, Optional, Tuple
 from dataclasses import dataclass, asdict
 from datetime import datetime
 from aiohttp import web
-from aiohttp.web import Request, Response, json_response
+from aiohttp.web import Request, Response
+import orjson
+import msgspec
 import signal
 import sys
 import pathlib
@@ -21,40 +25,63 @@ import pathlib
 import time
 
 TEST_DATA_FILE = pathlib.Path(__file__).parent.parent.parent / "result/agent.csv"
-FILE_LOCK = asyncio.Lock()
+METRIC_BUFFER_SIZE = 1 << 16  # metric bytes held before each write
+METRIC_SYNC_LINES = 1000  # metric lines written and synced at least this often
+METRIC_FLUSH_INTERVAL = 1.0  # idle seconds before buffered metrics are written
+# per-request add_route timing, off unless SDN_METRICS=1
+METRICS_ENABLED = bool(int(os.environ.get("SDN_METRICS", "0")))
+ROUTE_BATCH_MAX = 256  # max netlink messages sent in one write
+ROUTE_CONCURRENCY = 128  # max add_route calls a batch runs at once
+TIMESTAMP_INTERVAL = 0.1  # refresh period of the response timestamp, seconds
 
 
 try:
     from pyroute2 import AsyncIPRoute
     from pyroute2.netlink.exceptions import NetlinkError
+    from pyroute2.netlink.nlsocket import NetlinkRequest
+    from pyroute2.netlink.rtnl import RTM_NEWROUTE, RTM_DELROUTE, RTMGRP_LINK
+    from pyroute2.netlink.rtnl.rtmsg import rtmsg
+    from pyroute2.iproute.linux import get_arguments_processor
 
     PYROUTE2_AVAILABLE = True
 except ImportError:
     print("Warning: pyroute2 not available, install with: pip install pyroute2")
     PYROUTE2_AVAILABLE = False
     sys.exit(1)
+
+try:
+    import uvloop
+except ImportError:
+    uvloop = None
 log_path = pathlib.Path(__file__).parent.parent.parent / "log"
 
 log_file = log_path / "agent.log"
 
-# Configure logging
+# Configure logging. Records are queued by the caller and written to the
+# file by a listener thread, so no emit blocks the event loop on I/O
+_file_handler = logging.FileHandler(log_file)
+_file_handler.setFormatter(
+    logging.Formatter(
+        "%(asctime)s - %(name)s - %(filename)s:%(lineno)d - %(levelname)s - %(message)s"
+    )
+)
+_log_queue: queue.Queue = queue.Queue(-1)
+log_listener = logging.handlers.QueueListener(
+    _log_queue, _file_handler, respect_handler_level=True
+)
+log_listener.start()
+atexit.register(log_listener.stop)
+
+# the queue only carries the message, _file_handler applies the format
 logging.basicConfig(
     level=logging.DEBUG,
-    format="%(asctime)s - %(name)s - %(filename)s:%(lineno)d - %(levelname)s - %(message)s",
-    handlers=[logging.FileHandler(log_file)],
+    format="%(message)s",
+    handlers=[logging.handlers.QueueHandler(_log_queue)],
 )
 logger = logging.getLogger(__name__)
 
 
-######################## Metric logging function
-# async def log_metric_async(line: str):
-#     # write metrics to file
-#     async with FILE_LOCK:
-#         async with aiofiles.open(TEST_DATA_FILE, mode="a") as f:
-#             await f.write(line)
-
-
-@dataclass
+@dataclass(slots=True)
 class RouteEntry:
     """Represents a route entry"""
 
@@ -63,11 +90,62 @@ class RouteEntry:
     interface: Optional[str] = None
     metric: Optional[int] = None
     table: int = 254  # Default table (main)
-    created_at: str = None
+    created_at: Optional[int] = None  # time.time_ns(), formatted on demand
 
     def __post_init__(self):
         if self.created_at is None:
-            self.created_at = datetime.now().isoformat()
+            self.created_at = time.time_ns()
+
+
+class AddRouteRequest(msgspec.Struct):
+    """Body of POST /routes, also one entry of a batch add"""
+
+    destination: str
+    nexthop: str
+    interface: Optional[str] = None
+    metric: Optional[int] = 77
+    table: int = 254
+
+
+class BatchAddRequest(msgspec.Struct):
+    """Body of POST /routes/batch"""
+
+    routes: List[AddRouteRequest]
+
+
+@functools.lru_cache(maxsize=8192)
+def _norm_cidr(destination: str) -> str:
+    """
+    Normalized form of a destination, e.g. 10.0.0.1/24 -> 10.0.0.0/24. It is
+    also the key of the route table. Raises ValueError on invalid input.
+    """
+    return str(ipaddress.ip_network(destination, strict=False))
+
+
+@functools.lru_cache(maxsize=4096)
+def _parse_route(destination: str, nexthop: str) -> Tuple[str, str]:
+    """
+    Validate a destination/nexthop pair, returns their normalized string
+    forms. Cached, so a pair seen before is not parsed again; raises
+    ValueError on invalid input.
+    """
+    return _norm_cidr(destination), str(ipaddress.ip_address(nexthop))
+
+
+class AddRouteResponse(msgspec.Struct):
+    """Success body of POST /routes"""
+
+    success: bool
+    message: str
+    route: AddRouteRequest
+    timestamp: str
+
+
+# decode and validate request bodies in one pass
+_add_decoder = msgspec.json.Decoder(AddRouteRequest)
+_batch_add_decoder = msgspec.json.Decoder(BatchAddRequest)
+# encodes Structs straight to bytes, no intermediate dict
+_encoder = msgspec.json.Encoder()
 
 
 class AsyncRouteManager:
@@ -75,6 +153,49 @@ class AsyncRouteManager:
 
     def __init__(self, max_workers: int = 4):
         self.routes: Dict[str, RouteEntry] = {}  # destination -> RouteEntry
+        # one netlink socket for the agent's lifetime, see start()/stop()
+        self._aipr: Optional[AsyncIPRoute] = None
+        # interface name -> index, kept current by link events
+        self._ifindex: Dict[str, int] = {}
+        self._link_events: Optional[AsyncIPRoute] = None
+        self._link_task: Optional[asyncio.Task] = None
+
+    async def start(self):
+        """
+        Open the netlink socket shared by every route operation, and load the
+        interface index map
+        """
+        self._aipr = AsyncIPRoute()
+
+        # subscribe before the dump, so no change falls between the two
+        self._link_events = AsyncIPRoute()
+        await self._link_events.bind(groups=RTMGRP_LINK)
+        async for link in await self._aipr.get_links():
+            self._ifindex[link.get("ifname")] = link["index"]
+        self._link_task = asyncio.create_task(self._watch_links())
+
+    async def stop(self):
+        """Close the shared netlink socket and the link subscription"""
+        if self._link_task is not None:
+            self._link_task.cancel()
+            self._link_task = None
+        if self._link_events is not None:
+            self._link_events.close()
+            self._link_events = None
+        if self._aipr is not None:
+            self._aipr.close()
+            self._aipr = None
+
+    async def _watch_links(self):
+        """Apply RTM_NEWLINK/RTM_DELLINK events to the interface index map"""
+        while True:
+            async for msg in self._link_events.get():
+                name, index = msg.get("ifname"), msg["index"]
+                # a rename arrives as RTM_NEWLINK under the new name
+                for stale in [n for n, i in self._ifindex.items() if i == index]:
+                    del self._ifindex[stale]
+                if msg["event"] == "RTM_NEWLINK":
+                    self._ifindex[name] = index
 
     async def add_route(
         self,
@@ -83,20 +204,18 @@ class AsyncRouteManager:
         interface: str = None,
         metric: int = None,
         table: int = 254,
-        aipr: AsyncIPRoute = None,
     ) -> Tuple[bool, str]:
         """Add a route to the routing table"""
         try:
             # Validate destination network
-            network = ipaddress.ip_network(destination, strict=False)
-            nexthop_ip = ipaddress.ip_address(nexthop)
+            dst, gateway = _parse_route(destination, nexthop)
 
             # debug
             # print(self.routes)
 
             # Check if route already exists
-            if destination in self.routes:
-                existing = self.routes[destination]
+            if dst in self.routes:
+                existing = self.routes[dst]
                 if existing.nexthop == nexthop:
                     return True, f"Route {destination} via {nexthop} already exists"
                 else:
@@ -107,14 +226,14 @@ class AsyncRouteManager:
 
             # Prepare route parameters
             route_params = {
-                "dst": str(network),
-                "gateway": str(nexthop_ip),
+                "dst": dst,
+                "gateway": gateway,
                 "table": table,
             }
 
             # Add interface if specified
             if interface:
-                interface_index = await self._get_interface_index(interface)
+                interface_index = self._get_interface_index(interface)
                 if interface_index is None:
                     return False, f"Interface {interface} not found"
                 route_params["oif"] = interface_index
@@ -123,12 +242,7 @@ class AsyncRouteManager:
             if metric is not None:
                 route_params["priority"] = metric
 
-            # Add the route in thread pool
-            if aipr is None:
-                async with AsyncIPRoute() as aipr:
-                    await aipr.route("add", **route_params)
-            else:
-                await aipr.route("add", **route_params)
+            await self._aipr.route("add", **route_params)
 
             # Store route entry
             route_entry = RouteEntry(
@@ -138,7 +252,7 @@ class AsyncRouteManager:
                 metric=metric,
                 table=table,
             )
-            self.routes[destination] = route_entry
+            self.routes[dst] = route_entry
 
             logger.info(f"Added route: {destination} via {nexthop}")
             return True, f"Successfully added route {destination} via {nexthop}"
@@ -161,40 +275,41 @@ class AsyncRouteManager:
         destination: str,
         nexthop: str = None,
         table: int = 254,
-        aipr: AsyncIPRoute = None,
+        metric: int = None,
     ) -> Tuple[bool, str]:
         """Delete a route from the routing table"""
 
         try:
             # Check if route exists in our tracking
-            if destination not in self.routes:
+            try:
+                key = _norm_cidr(destination)
+            except ValueError:
+                key = None
+            if key not in self.routes:
                 return False, f"Route {destination} not found in tracking"
 
-            route_entry = self.routes[destination]
+            route_entry = self.routes[key]
 
             # Use stored nexthop if not provided
             if nexthop is None:
                 nexthop = route_entry.nexthop
 
             # Validate addresses
-            network = ipaddress.ip_network(destination, strict=False)
-            nexthop_ip = ipaddress.ip_address(nexthop)
+            dst, gateway = _parse_route(destination, nexthop)
 
             # Prepare route parameters
             route_params = {
-                "dst": str(network),
-                "gateway": str(nexthop_ip),
+                "dst": dst,
+                "gateway": gateway,
                 "table": table,
             }
+            if metric is not None:
+                route_params["priority"] = metric
 
-            if aipr is None:
-                async with AsyncIPRoute() as aipr:
-                    await aipr.route("del", **route_params)
-            else:
-                await aipr.route("del", **route_params)
+            await self._aipr.route("del", **route_params)
 
             # Remove from tracking
-            del self.routes[destination]
+            del self.routes[key]
 
             logger.info(f"Deleted route: {destination} via {nexthop}")
             return True, f"Successfully deleted route {destination} via {nexthop}"
@@ -222,78 +337,257 @@ class AsyncRouteManager:
     ) -> Tuple[bool, str]:
         """Update an existing route"""
 
-        # Delete old route
-        success, msg = await self.delete_route(destination, table=table)
-        if not success:
-            return False, f"Failed to delete old route: {msg}"
+        existing = self.routes[_norm_cidr(destination)]
+        if existing.table != table or existing.metric != metric:
+            # replace only matches a route in the same table with the same
+            # metric, anything else needs the old one deleted first, from
+            # where it was installed
+            success, msg = await self.delete_route(
+                destination, table=existing.table, metric=existing.metric
+            )
+            if not success:
+                return False, f"Failed to delete old route: {msg}"
+
+            return await self.add_route(destination, nexthop, interface, metric, table)
+
+        try:
+            dst, gateway = _parse_route(destination, nexthop)
+            route_params = {"dst": dst, "gateway": gateway, "table": table}
+
+            if interface:
+                interface_index = self._get_interface_index(interface)
+                if interface_index is None:
+                    return False, f"Interface {interface} not found"
+                route_params["oif"] = interface_index
+
+            if metric is not None:
+                route_params["priority"] = metric
+
+            # one atomic RTM_NEWROUTE with NLM_F_REPLACE
+            await self._aipr.route("replace", **route_params)
+
+            existing.nexthop = nexthop
+            existing.interface = interface
+
+            logger.info(f"Replaced route: {destination} via {nexthop}")
+            return True, f"Successfully added route {destination} via {nexthop}"
 
-        # Add new route
-        return await self.add_route(destination, nexthop, interface, metric, table)
+        except NetlinkError as e:
+            error_msg = (
+                f"Netlink error replacing route {destination} via {nexthop}: {e}"
+            )
+            logger.error(error_msg)
+            return False, error_msg
+        except Exception as e:
+            error_msg = f"Unexpected error replacing route: {e}"
+            logger.error(error_msg)
+            return False, error_msg
 
-    async def _get_interface_index(self, interface_name: str) -> Optional[int]:
+    def _get_interface_index(self, interface_name: str) -> Optional[int]:
         """Get interface index by name"""
+        return self._ifindex.get(interface_name)
+
+    async def _route_batch(
+        self, command: str, params_list: List[Dict]
+    ) -> List[Optional[NetlinkError]]:
+        """
+        Send one route message per entry of params_list in a single netlink
+        write, then collect the kernel's answer to each. Returns the error
+        of every message, None where it was acked.
+        """
+        command_map = {
+            "add": (RTM_NEWROUTE, "create"),
+            "del": (RTM_DELROUTE, "req"),
+        }
+        parameters = {"strict_check": self._aipr.status["strict_check"]}
+
+        requests = []
+        answered = 0  # requests whose response() ran, it cleans them up
         try:
-            async with AsyncIPRoute() as aipr:
-                links = await aipr.get_links()
-
-            for link in links:
-                for attr in link["attrs"]:
-                    if attr[0] == "IFLA_IFNAME" and attr[1] == interface_name:
-                        return link["index"]
-            return None
-        except Exception:
-            return None
-
-    async def batch_add_routes(self, routes: List[Dict]) -> List[Tuple[bool, str]]:
-        """Add multiple routes concurrently"""
-        tasks = []
-
-        async with AsyncIPRoute() as aipr:
-            for route_data in routes:
-                task = self.add_route(
-                    route_data["destination"],
-                    route_data["nexthop"],
-                    route_data.get("interface"),
-                    route_data.get("metric", 77),
-                    route_data.get("table", 254),
-                    aipr=aipr,
+            data = bytearray()
+            for params in params_list:
+                if command == "add":
+                    params = {"proto": "static", "type": "unicast", **params}
+                arguments = get_arguments_processor(
+                    "route", command, params, parameters
                 )
-                tasks.append(task)
+                request = NetlinkRequest(
+                    self._aipr, rtmsg(), command, command_map, None, arguments
+                )
+                await request.prepare()
+                requests.append(request)
+                data += request.msg.data
+
+            self._aipr.send(bytes(data))
+
+            errors = []
+            for request in requests:
+                answered += 1
+                try:
+                    async for _ in request.response():
+                        pass
+                    errors.append(None)
+                except NetlinkError as e:
+                    errors.append(e)
+            return errors
+        finally:
+            # the rest still hold their sequence numbers and queue tags
+            for request in requests[answered:]:
+                request.cleanup()
+
+    async def batch_add_routes(
+        self, routes: List[AddRouteRequest]
+    ) -> List[Tuple[bool, str]]:
+        """
+        Add multiple routes. New routes without an interface are sent to the
+        kernel ROUTE_BATCH_MAX messages at a time; updates and routes bound
+        to an interface go through add_route, ROUTE_CONCURRENCY at a time.
+        """
+        results: List[Optional[Tuple[bool, str]]] = [None] * len(routes)
+        pending = []  # (index, route_params, route_entry)
+        single = []  # (index, add_route coroutine)
+
+        for i, route in enumerate(routes):
+            destination = route.destination
+            nexthop = route.nexthop
+            interface = route.interface
+            metric = route.metric
+            table = route.table
 
-        results = await asyncio.gather(*tasks, return_exceptions=True)
+            try:
+                dst, gateway = _parse_route(destination, nexthop)
+            except ValueError as e:
+                error_msg = f"Invalid IP address/network: {e}"
+                logger.error(error_msg)
+                results[i] = (False, error_msg)
+                continue
+
+            if interface or dst in self.routes:
+                single.append(
+                    (i, self.add_route(destination, nexthop, interface, metric, table))
+                )
+                continue
 
-        # Convert exceptions to error tuples
-        processed_results = []
-        for result in results:
-            if isinstance(result, Exception):
-                processed_results.append((False, str(result)))
-            else:
-                processed_results.append(result)
+            route_params = {
+                "dst": dst,
+                "gateway": gateway,
+                "table": table,
+            }
+            if metric is not None:
+                route_params["priority"] = metric
+            route_entry = RouteEntry(
+                destination=destination,
+                nexthop=nexthop,
+                interface=interface,
+                metric=metric,
+                table=table,
+            )
+            pending.append((i, route_params, route_entry))
 
-        return processed_results
+        for start in range(0, len(single), ROUTE_CONCURRENCY):
+            chunk = single[start : start + ROUTE_CONCURRENCY]
+            chunk_results = await asyncio.gather(
+                *(task for _, task in chunk), return_exceptions=True
+            )
+            for (i, _), result in zip(chunk, chunk_results):
+                results[i] = result
+
+        for start in range(0, len(pending), ROUTE_BATCH_MAX):
+            chunk = pending[start : start + ROUTE_BATCH_MAX]
+            try:
+                errors = await self._route_batch("add", [p for _, p, _ in chunk])
+            except Exception as e:
+                error_msg = f"Unexpected error adding route: {e}"
+                logger.error(error_msg)
+                for i, _, _ in chunk:
+                    results[i] = (False, error_msg)
+                continue
+
+            for (i, route_params, route_entry), error in zip(chunk, errors):
+                destination, nexthop = route_entry.destination, route_entry.nexthop
+                if error is None:
+                    self.routes[route_params["dst"]] = route_entry
+                    logger.info(f"Added route: {destination} via {nexthop}")
+                    results[i] = (
+                        True,
+                        f"Successfully added route {destination} via {nexthop}",
+                    )
+                else:
+                    error_msg = f"Netlink error adding route {destination} via {nexthop}: {error}"
+                    logger.error(error_msg)
+                    results[i] = (False, error_msg)
+
+        # Convert exceptions to error tuples
+        return [
+            (False, str(result)) if isinstance(result, Exception) else result
+            for result in results
+        ]
 
     async def batch_delete_routes(
         self, destinations: List[str], table: int = 254
     ) -> List[Tuple[bool, str]]:
-        """Delete multiple routes concurrently"""
-        tasks = []
-
-        async with AsyncIPRoute() as aipr:
-            for destination in destinations:
-                task = self.delete_route(destination, table=table, aipr=aipr)
-                tasks.append(task)
+        """
+        Delete multiple routes, sent to the kernel ROUTE_BATCH_MAX messages
+        at a time
+        """
+        results: List[Optional[Tuple[bool, str]]] = [None] * len(destinations)
+        pending = []  # (index, route_params, destination, nexthop)
+
+        for i, destination in enumerate(destinations):
+            try:
+                key = _norm_cidr(destination)
+            except TypeError:
+                # unhashable entry, e.g. a JSON object
+                results[i] = (False, f"Invalid destination: {destination}")
+                continue
+            except ValueError:
+                key = None
+            if key not in self.routes:
+                results[i] = (False, f"Route {destination} not found in tracking")
+                continue
+
+            nexthop = self.routes[key].nexthop
+            try:
+                dst, gateway = _parse_route(destination, nexthop)
+            except ValueError as e:
+                error_msg = f"Invalid IP address/network: {e}"
+                logger.error(error_msg)
+                results[i] = (False, error_msg)
+                continue
 
-        results = await asyncio.gather(*tasks, return_exceptions=True)
+            route_params = {
+                "dst": dst,
+                "gateway": gateway,
+                "table": table,
+            }
+            pending.append((i, route_params, destination, nexthop))
 
-        # Convert exceptions to error tuples
-        processed_results = []
-        for result in results:
-            if isinstance(result, Exception):
-                processed_results.append((False, str(result)))
-            else:
-                processed_results.append(result)
+        for start in range(0, len(pending), ROUTE_BATCH_MAX):
+            chunk = pending[start : start + ROUTE_BATCH_MAX]
+            try:
+                errors = await self._route_batch("del", [p for _, p, _, _ in chunk])
+            except Exception as e:
+                error_msg = f"Unexpected error deleting route: {e}"
+                logger.error(error_msg)
+                for i, _, _, _ in chunk:
+                    results[i] = (False, error_msg)
+                continue
+
+            for (i, route_params, destination, nexthop), error in zip(chunk, errors):
+                if error is None:
+                    # a destination listed twice is only tracked once
+                    self.routes.pop(route_params["dst"], None)
+                    logger.info(f"Deleted route: {destination} via {nexthop}")
+                    results[i] = (
+                        True,
+                        f"Successfully deleted route {destination} via {nexthop}",
+                    )
+                else:
+                    error_msg = f"Netlink error deleting route {destination}: {error}"
+                    logger.error(error_msg)
+                    results[i] = (False, error_msg)
 
-        return processed_results
+        return results
 
     async def cleanup_all_managed_routes(self):
         """Clean up all routes managed by this agent (for shutdown)"""
@@ -319,6 +613,32 @@ AIO HTTP Server
 """
 
 
+def orjson_response(data, status: int = 200) -> Response:
+    """json_response, serialized with orjson"""
+    return web.Response(
+        body=orjson.dumps(data), status=status, content_type="application/json"
+    )
+
+
+# bodies of the fixed 400 responses, serialized once
+_ERROR_BODIES = {
+    "invalid_json": orjson.dumps(
+        {"success": False, "error": "Invalid JSON in request body"}
+    ),
+    "no_destinations": orjson.dumps(
+        {"success": False, "error": 'Expected "destinations" array in request body'}
+    ),
+}
+
+
+def error_response(key: str) -> Response:
+    """400 response with a preserialized body from _ERROR_BODIES"""
+    # a Response can only be sent once, so only the body is shared
+    return web.Response(
+        body=_ERROR_BODIES[key], status=400, content_type="application/json"
+    )
+
+
 class AsyncSDNAgent:
     """Async SDN Agent with aiohttp web server"""
 
@@ -330,6 +650,15 @@ class AsyncSDNAgent:
         self.runner = None
         self.site = None
 
+        # metric lines are queued by handlers and written by one task
+        self._metric_queue: asyncio.Queue = asyncio.Queue()
+        self._metric_task: Optional[asyncio.Task] = None
+        self._metric_failed = False  # set when the metric file can't be written
+
+        # responses share one timestamp string, refreshed in the background
+        self.timestamp = datetime.now().isoformat()
+        self._clock_task: Optional[asyncio.Task] = None
+
         # Setup routes for api
         self._setup_routes()
 
@@ -349,6 +678,74 @@ class AsyncSDNAgent:
         # Add logging middleware
         self.app.middlewares.append(self._logging_middleware)
 
+    def log_metric(self, destination: str, nexthop: str, wait: float, apply: float):
+        """Queue one metric row, no I/O happens on the request path"""
+        if not self._metric_failed:
+            self._metric_queue.put_nowait((destination, nexthop, wait, apply))
+
+    async def _metric_writer(self):
+        """
+        Format queued metric rows straight to bytes and write them to
+        TEST_DATA_FILE with one os.write per METRIC_BUFFER_SIZE, or whatever is
+        buffered once the queue idles for METRIC_FLUSH_INTERVAL. Every
+        METRIC_SYNC_LINES lines the buffer is written and the file synced, and
+        once more on shutdown. An I/O
+        error disables metrics instead of failing the agent
+        """
+        fd = None
+        buf = bytearray()
+        lines = 0  # lines queued since the last sync
+        try:
+            while True:
+                try:
+                    row = await asyncio.wait_for(
+                        self._metric_queue.get(), METRIC_FLUSH_INTERVAL
+                    )
+                except asyncio.TimeoutError:
+                    row = False  # idle, write out what is buffered
+
+                # None is queued last by stop()
+                if row:
+                    destination, nexthop, wait, apply = row
+                    buf += b"%s, %s, %.6f, %.6f\n" % (
+                        destination.encode(),
+                        nexthop.encode(),
+                        wait,
+                        apply,
+                    )
+                    lines += 1
+                if buf and (
+                    not row
+                    or len(buf) >= METRIC_BUFFER_SIZE
+                    or lines >= METRIC_SYNC_LINES
+                ):
+                    if fd is None:
+                        TEST_DATA_FILE.parent.mkdir(parents=True, exist_ok=True)
+                        fd = os.open(
+                            TEST_DATA_FILE,
+                            os.O_WRONLY | os.O_APPEND | os.O_CREAT | os.O_CLOEXEC,
+                            0o644,
+                        )
+                    os.write(fd, buf)
+                    buf.clear()
+                    if row is None or lines >= METRIC_SYNC_LINES:
+                        await asyncio.to_thread(os.fdatasync, fd)
+                        lines = 0
+                if row is None:
+                    return
+        except OSError as e:
+            self._metric_failed = True
+            logger.warning(f"Metrics disabled, failed to write {TEST_DATA_FILE}: {e}")
+        finally:
+            if fd is not None:
+                os.close(fd)
+
+    async def _refresh_timestamp(self):
+        """Keep self.timestamp within TIMESTAMP_INTERVAL of the wall clock"""
+        while True:
+            self.timestamp = datetime.now().isoformat()
+            await asyncio.sleep(TIMESTAMP_INTERVAL)
+
     @web.middleware
     async def _cors_middleware(self, request: Request, handler):
         """CORS middleware"""
@@ -372,15 +769,24 @@ class AsyncSDNAgent:
 
         try:
             response = await handler(request)
-            process_time = asyncio.get_event_loop().time() - start_time
-            logger.info(
-                f"{request.method} {request.path} - {response.status} - {process_time:.3f}s"
-            )
+            if logger.isEnabledFor(logging.INFO):
+                process_time = asyncio.get_event_loop().time() - start_time
+                logger.info(
+                    "%s %s - %s - %.3fs",
+                    request.method,
+                    request.path,
+                    response.status,
+                    process_time,
+                )
             return response
         except Exception as e:
             process_time = asyncio.get_event_loop().time() - start_time
             logger.error(
-                f"{request.method} {request.path} - ERROR: {e} - {process_time:.3f}s"
+                "%s %s - ERROR: %s - %.3fs",
+                request.method,
+                request.path,
+                e,
+                process_time,
             )
             raise
 
@@ -388,67 +794,53 @@ class AsyncSDNAgent:
         """Add route endpoint"""
 
         # Timeframe receiving the request
-        # T1 = time.perf_counter()
+        if METRICS_ENABLED:
+            T1 = time.perf_counter()
 
         try:
-            data = await request.json()
-
-            # Validate required fields
-            required_fields = ["destination", "nexthop"]
-            for field in required_fields:
-                if field not in data:
-                    return json_response(
-                        {"success": False, "error": f"Missing required field: {field}"},
-                        status=400,
-                    )
+            req = _add_decoder.decode(await request.read())
 
             # Extract parameters
-            destination = data["destination"]
-            nexthop = data["nexthop"]
-            interface = data.get("interface")
-            metric = data.get("metric", 77)
-            table = data.get("table", 254)
+            destination = req.destination
+            nexthop = req.nexthop
+            interface = req.interface
+            metric = req.metric
+            table = req.table
 
             # Timeframe before calling applying rules
-            # T1a = time.perf_counter()
+            if METRICS_ENABLED:
+                T1a = time.perf_counter()
 
             # Add route
             success, message = await self.route_manager.add_route(
                 destination, nexthop, interface, metric, table
             )
 
-            # Timeframe after applying rules
-            # T2 = time.perf_counter()
+            if METRICS_ENABLED:
+                # Timeframe after applying rules
+                T2 = time.perf_counter()
 
-            # log time
-            # await log_metric_async(
-            #     f"{destination}, {nexthop}, {T1a - T1:.6f}, {T2 - T1a:.6f}"
-            # )
+                # log time
+                self.log_metric(destination, nexthop, T1a - T1, T2 - T1a)
 
             if success:
-                response_data = {
-                    "success": True,
-                    "message": message,
-                    "route": {
-                        "destination": destination,
-                        "nexthop": nexthop,
-                        "interface": interface,
-                        "metric": metric,
-                        "table": table,
-                    },
-                    "timestamp": datetime.now().isoformat(),
-                }
-                return json_response(response_data, status=201)
+                # the decoded request already holds the route fields
+                response_data = AddRouteResponse(True, message, req, self.timestamp)
+                return web.Response(
+                    body=_encoder.encode(response_data),
+                    status=201,
+                    content_type="application/json",
+                )
             else:
-                return json_response({"success": False, "error": message}, status=400)
+                return orjson_response({"success": False, "error": message}, status=400)
 
-        except json.JSONDecodeError:
-            return json_response(
-                {"success": False, "error": "Invalid JSON in request body"}, status=400
-            )
+        except msgspec.ValidationError as e:
+            return orjson_response({"success": False, "error": str(e)}, status=400)
+        except msgspec.DecodeError:
+            return error_response("invalid_json")
         except Exception as e:
             logger.error(f"Error adding route: {e}")
-            return json_response({"success": False, "error": str(e)}, status=500)
+            return orjson_response({"success": False, "error": str(e)}, status=500)
 
     async def delete_route(self, request: Request) -> Response:
         """Delete route endpoint"""
@@ -459,7 +851,7 @@ class AsyncSDNAgent:
 
             # Parse JSON body for additional parameters
             try:
-                data = await request.json()
+                data = orjson.loads(await request.read())
             except:
                 data = {}
 
@@ -475,95 +867,65 @@ class AsyncSDNAgent:
                 response_data = {
                     "success": True,
                     "message": message,
-                    "timestamp": datetime.now().isoformat(),
+                    "timestamp": self.timestamp,
                 }
-                return json_response(response_data)
+                return orjson_response(response_data)
             else:
-                return json_response({"success": False, "error": message}, status=400)
+                return orjson_response({"success": False, "error": message}, status=400)
 
         except Exception as e:
             logger.error(f"Error deleting route: {e}")
-            return json_response({"success": False, "error": str(e)}, status=500)
+            return orjson_response({"success": False, "error": str(e)}, status=500)
 
     async def batch_add_routes(self, request: Request) -> Response:
         """Batch add routes endpoint"""
         try:
-            data = await request.json()
-
-            if not isinstance(data.get("routes"), list):
-                return json_response(
-                    {
-                        "success": False,
-                        "error": 'Expected "routes" array in request body',
-                    },
-                    status=400,
-                )
-
-            routes_data = data["routes"]
-
-            # Validate each route
-            for i, route_data in enumerate(routes_data):
-                required_fields = ["destination", "nexthop"]
-                for field in required_fields:
-                    if field not in route_data:
-                        return json_response(
-                            {
-                                "success": False,
-                                "error": f"Route {i}: Missing required field: {field}",
-                            },
-                            status=400,
-                        )
+            routes_data = _batch_add_decoder.decode(await request.read()).routes
 
             # Add routes concurrently
             results = await self.route_manager.batch_add_routes(routes_data)
 
-            # Prepare response
-            response_routes = []
+            # Prepare response, in one pass over the results
+            response_routes = [None] * len(results)
+            failed = 0
             for i, (success, message) in enumerate(results):
-                response_routes.append(
-                    {
-                        "index": i,
-                        "route": routes_data[i],
-                        "success": success,
-                        "message": message,
-                    }
-                )
+                response_routes[i] = {
+                    "index": i,
+                    "route": msgspec.structs.asdict(routes_data[i]),
+                    "success": success,
+                    "message": message,
+                }
+                failed += not success
 
-            overall_success = all(result[0] for result in results)
+            overall_success = failed == 0
 
             response_data = {
                 "success": overall_success,
                 "results": response_routes,
                 "total": len(routes_data),
-                "successful": sum(1 for result in results if result[0]),
-                "failed": sum(1 for result in results if not result[0]),
-                "timestamp": datetime.now().isoformat(),
+                "successful": len(results) - failed,
+                "failed": failed,
+                "timestamp": self.timestamp,
             }
 
             status_code = 201 if overall_success else 207  # 207 Multi-Status
-            return json_response(response_data, status=status_code)
+            return orjson_response(response_data, status=status_code)
 
-        except json.JSONDecodeError:
-            return json_response(
-                {"success": False, "error": "Invalid JSON in request body"}, status=400
-            )
+        except msgspec.ValidationError as e:
+            return orjson_response({"success": False, "error": str(e)}, status=400)
+        except msgspec.DecodeError:
+            return error_response("invalid_json")
         except Exception as e:
             logger.error(f"Error in batch add routes: {e}")
-            return json_response({"success": False, "error": str(e)}, status=500)
+            return orjson_response({"success": False, "error": str(e)}, status=500)
 
     async def batch_delete_routes(self, request: Request) -> Response:
         """Batch delete routes endpoint"""
         try:
-            data = await request.json()
+            data = orjson.loads(await request.read())
 
             if not isinstance(data.get("destinations"), list):
-                return json_response(
-                    {
-                        "success": False,
-                        "error": 'Expected "destinations" array in request body',
-                    },
-                    status=400,
-                )
+                return error_response("no_destinations")
 
             destinations = data["destinations"]
             table = data.get("table", 254)
@@ -571,44 +933,48 @@ class AsyncSDNAgent:
             # Delete routes concurrently
             results = await self.route_manager.batch_delete_routes(destinations, table)
 
-            # Prepare response
-            response_routes = []
+            # Prepare response, in one pass over the results
+            response_routes = [None] * len(results)
+            failed = 0
             for i, (success, message) in enumerate(results):
-                response_routes.append(
-                    {
-                        "index": i,
-                        "destination": destinations[i],
-                        "success": success,
-                        "message": message,
-                    }
-                )
+                response_routes[i] = {
+                    "index": i,
+                    "destination": destinations[i],
+                    "success": success,
+                    "message": message,
+                }
+                failed += not success
 
-            overall_success = all(result[0] for result in results)
+            overall_success = failed == 0
 
             response_data = {
                 "success": overall_success,
                 "results": response_routes,
                 "total": len(destinations),
-                "successful": sum(1 for result in results if result[0]),
-                "failed": sum(1 for result in results if not result[0]),
-                "timestamp": datetime.now().isoformat(),
+                "successful": len(results) - failed,
+                "failed": failed,
+                "timestamp": self.timestamp,
             }
 
-            return json_response(response_data)
+            return orjson_response(response_data)
 
-        except json.JSONDecodeError:
-            return json_response(
-                {"success": False, "error": "Invalid JSON in request body"}, status=400
-            )
+        except orjson.JSONDecodeError:
+            return error_response("invalid_json")
         except Exception as e:
             logger.error(f"Error in batch delete routes: {e}")
-            return json_response({"success": False, "error": str(e)}, status=500)
+            return orjson_response({"success": False, "error": str(e)}, status=500)
 
     async def start(self):
         """Start the async SDN agent"""
         logger.info(f"Starting Async SDN Agent on {self.host}:{self.port}")
 
-        self.runner = web.AppRunner(self.app)
+        if METRICS_ENABLED:
+            self._metric_task = asyncio.create_task(self._metric_writer())
+        self._clock_task = asyncio.create_task(self._refresh_timestamp())
+        await self.route_manager.start()
+
+        # requests are already logged by _logging_middleware
+        self.runner = web.AppRunner(self.app, access_log=None)
         await self.runner.setup()
 
         self.site = web.TCPSite(self.runner, self.host, self.port)
@@ -628,8 +994,23 @@ class AsyncSDNAgent:
         if self.site:
             await self.site.stop()
 
+        # flush queued metrics, the writer only runs with METRICS_ENABLED
+        if self._metric_task:
+            self._metric_queue.put_nowait(None)
+            try:
+                await self._metric_task
+            except Exception as e:
+                # routes below must be cleaned up regardless
+                logger.error(f"Error flushing metrics: {e}")
+            self._metric_task = None
+
+        if self._clock_task:
+            self._clock_task.cancel()
+            self._clock_task = None
+
         # cleanup managed routes
         await self.route_manager.cleanup_all_managed_routes()
+        await self.route_manager.stop()
 
         if self.runner:
             await self.runner.cleanup()
@@ -686,6 +1067,8 @@ async def main():
 
 
 if __name__ == "__main__":
+    if uvloop is not None:
+        asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
     try:
         asyncio.run(main())
     except KeyboardInterrupt:
@@ -1,22 +1,40 @@
 import aiohttp
+import orjson
 import logging
 import asyncio
 
 from typing import List, Dict, Optional
 
+JSON_HEADERS = {"Content-Type": "application/json"}
+
 
 class AsyncAgentController:
-    def __init__(self, agent_url: str, logger: logging.Logger) -> None:
+    def __init__(
+        self, agent_url: str, logger: logging.Logger, limit_per_host: int = 1024
+    ) -> None:
         if not agent_url or not logger:
             raise ValueError("agent_url or logger is None")
 
         self.agent_url = agent_url
         self.session = None
         self.logger = logger
+        self.limit_per_host = limit_per_host
 
     async def __aenter__(self):
         try:
-            self.session = aiohttp.ClientSession()
+            # every call goes to the same agent, size the pool for that host
+            # instead of the default 100 connection cap
+            connector = aiohttp.TCPConnector(
+                limit=0,
+                limit_per_host=self.limit_per_host,
+                keepalive_timeout=75,
+                enable_cleanup_closed=True,
+            )
+            self.session = aiohttp.ClientSession(
+                connector=connector,
+                timeout=aiohttp.ClientTimeout(total=30),
+                headers={"Connection": "keep-alive"},
+            )
         except Exception as e:
             self.logger.error(f"Failed to create aiohttp session: {e}")
             raise
@@ -39,8 +57,10 @@ class AsyncAgentController:
             data["interface"] = interface
 
         try:
-            async with self.session.post(url, json=data) as response:
-                return await response.json()
+            async with self.session.post(
+                url, data=orjson.dumps(data), headers=JSON_HEADERS
+            ) as response:
+                return orjson.loads(await response.read())
         except asyncio.TimeoutError:
             self.logger.error("Request timed out in add_route")
             raise
@@ -58,7 +78,7 @@ class AsyncAgentController:
 
         try:
             async with self.session.delete(url) as response:
-                return await response.json()
+                return orjson.loads(await response.read())
         except asyncio.TimeoutError:
             self.logger.error("Request timed out in delete_route")
             raise
@@ -75,8 +95,10 @@ class AsyncAgentController:
         data = {"routes": routes}
 
         try:
-            async with self.session.post(url, json=data) as response:
-                return await response.json()
+            async with self.session.post(
+                url, data=orjson.dumps(data), headers=JSON_HEADERS
+            ) as response:
+                return orjson.loads(await response.read())
         except asyncio.TimeoutError:
             self.logger.error("Request timed out in batch_add_routes")
             raise
@@ -93,8 +115,10 @@ class AsyncAgentController:
         data = {"destinations": destinations}
 
         try:
-            async with self.session.delete(url, json=data) as response:
-                return await response.json()
+            async with self.session.delete(
+                url, data=orjson.dumps(data), headers=JSON_HEADERS
+            ) as response:
+                return orjson.loads(await response.read())
         except asyncio.TimeoutError:
             self.logger.error("Request timed out in batch_delete_routes")
             raise
@@ -1,7 +1,5 @@
 import asyncio
-import json
-import logging
-import traceback
+import orjson
 
 from ryu.app.wsgi import ControllerBase, route
 from webob import Response
@@ -14,17 +12,24 @@ REST_API_INSTANCE_NAME = "rest_api_app"
 
 PRIORITY = 77
 
+# handlers of /api/batch commands, by (type, action)
+BATCH_COMMANDS = {
+    ("route", "remove"): lambda app, ips: app._remove_route_via_agent(ips),
+    ("flow", "block"): lambda app, ips: app.add_flow_block(ips, PRIORITY),
+}
+
 
 class RestNBController(ControllerBase):
     def __init__(self, req, link, data, **config):
         super(RestNBController, self).__init__(req, link, data, **config)
         self.app = data[REST_API_INSTANCE_NAME]
-        self.logger = logging.getLogger(__name__)
+        # the app's logger carries the controller log handlers
+        self.logger = self.app.logger
 
     @route("switches", "/api/switches", methods=["GET"])
     def get_switches(self, req, **kwargs):
-        switches_list = list(self.app.switches.keys())
-        body = json.dumps({"swithces": switches_list}).encode()
+        # serialized by the app whenever the switch set changes
+        body = self.app._switches_json
         return Response(content_type="application/json", body=body)
 
     @route("flows", "/api/flows/{dpid}", methods=["GET"])
@@ -37,143 +42,135 @@ class RestNBController(ControllerBase):
 
         try:
             result = future.result(timeout=2)
-            body = json.dumps(result).encode()
+            body = orjson.dumps(result)
             return Response(content_type="application/json", body=body)
         except Exception as e:
-            body = json.dumps({"error": str(e)}).encode()
+            body = orjson.dumps({"error": str(e)})
             return Response(content_type="application/json", body=body, status=500)
 
     @route("block", "/api/block", methods=["POST"])
     def add_flow_block(self, req, **kwargs):
         try:
-            data = json.loads(req.body)
+            data = orjson.loads(req.body)
             ips = data.get("ips")
             priority = data.get("priority", PRIORITY)
 
             if ips is None:
-                body = json.dumps(
-                    {"error": "Missing required parameters: ips"}
-                ).encode()
+                body = orjson.dumps({"error": "Missing required parameters: ips"})
                 return Response(content_type="application/json", body=body, status=400)
             result = self.app.add_flow_block(ips, priority)
-            body = json.dumps(result).encode()
+            body = orjson.dumps(result)
 
             if "error" in result:
                 return Response(content_type="application/json", body=body, status=404)
             else:
                 return Response(content_type="application/json", body=body)
 
-        except json.JSONDecodeError:
-            body = json.dumps({"error": "Invalid JSON in request body"}).encode()
+        except orjson.JSONDecodeError:
+            body = orjson.dumps({"error": "Invalid JSON in request body"})
             return Response(content_type="application/json", body=body, status=400)
         except Exception as e:
-            body = json.dumps({"error": str(e)}).encode()
+            body = orjson.dumps({"error": str(e)})
             return Response(content_type="application/json", body=body, status=500)
 
     @route("route", "/api/route", methods=["POST"])
     def add_flow_route(self, req, **kwargs):
         try:
-            data = json.loads(req.body)
+            data = orjson.loads(req.body)
             ips = data.get("ips")
             nexthop = data.get("nexthop")
             priority = data.get("priority", PRIORITY)
 
             if ips is None or nexthop is None:
-                body = json.dumps(
+                body = orjson.dumps(
                     {"error": "Missing required parameters: ips, nexthop"}
-                ).encode()
+                )
                 return Response(content_type="application/json", body=body, status=400)
             result = self.app.add_flow_route(ips, nexthop, priority)
-            body = json.dumps(result).encode()
+            body = orjson.dumps(result)
 
             if "error" in result:
                 return Response(content_type="application/json", body=body, status=404)
             else:
                 return Response(content_type="application/json", body=body)
 
-        except json.JSONDecodeError:
-            body = json.dumps({"error": "Invalid JSON in request body"}).encode()
+        except orjson.JSONDecodeError:
+            body = orjson.dumps({"error": "Invalid JSON in request body"})
             return Response(content_type="application/json", body=body, status=400)
         except Exception as e:
-            body = json.dumps({"error": str(e)}).encode()
+            body = orjson.dumps({"error": str(e)})
             return Response(content_type="application/json", body=body, status=500)
 
     @route("remove", "/api/remove/flow", methods=["DELETE"])
     def remove_flow(self, req, **kwargs):
         self.logger.debug("correctly getting /remove/flow requests")
         try:
-            data = json.loads(req.body)
+            data = orjson.loads(req.body)
             ips = data.get("ips")
 
             if ips is None:
-                body = json.dumps(
-                    {"error": "Missing required parameters: ips"}
-                ).encode()
+                body = orjson.dumps({"error": "Missing required parameters: ips"})
                 return Response(content_type="application/json", body=body, status=400)
             result = self.app.remove_flow(ips)
-            body = json.dumps(result).encode()
+            body = orjson.dumps(result)
 
             if "error" in result:
                 return Response(content_type="application/json", body=body, status=404)
             else:
                 return Response(content_type="application/json", body=body)
 
-        except json.JSONDecodeError:
-            body = json.dumps({"error": "Invalid JSON in request body"}).encode()
+        except orjson.JSONDecodeError:
+            body = orjson.dumps({"error": "Invalid JSON in request body"})
             return Response(content_type="application/json", body=body, status=400)
         except Exception as e:
-            body = json.dumps({"error": str(e)}).encode()
-            traceback.print_exc()
+            body = orjson.dumps({"error": str(e)})
+            self.logger.exception("remove_flow failed: %s", e)
             return Response(content_type="application/json", body=body, status=500)
 
     @route("remove", "/api/remove/route", methods=["DELETE"])
     def remove_route(self, req, **kwargs):
         try:
-            data = json.loads(req.body)
+            data = orjson.loads(req.body)
             ips = data.get("ips")
 
             if ips is None:
-                body = json.dumps(
-                    {"error": "Missing required parameters: ips"}
-                ).encode()
+                body = orjson.dumps({"error": "Missing required parameters: ips"})
                 return Response(content_type="application/json", body=body, status=400)
             result = self.app._remove_route_via_agent(ips)
-            body = json.dumps(result).encode()
+            body = orjson.dumps(result)
 
             if "error" in result:
                 return Response(content_type="application/json", body=body, status=404)
             else:
                 return Response(content_type="application/json", body=body)
 
-        except json.JSONDecodeError:
-            body = json.dumps({"error": "Invalid JSON in request body"}).encode()
+        except orjson.JSONDecodeError:
+            body = orjson.dumps({"error": "Invalid JSON in request body"})
             return Response(content_type="application/json", body=body, status=400)
         except Exception as e:
-            body = json.dumps({"error": str(e)}).encode()
+            body = orjson.dumps({"error": str(e)})
             return Response(content_type="application/json", body=body, status=500)
 
     @route("batch", "/api/batch", methods=["POST"])
     def batch_flow_route(self, req, **kwargs):
         try:
-            data = json.loads(req.body)
+            data = orjson.loads(req.body)
             commands = data.get("commands")
-            results = {}
+            errors, resps = [], []
             for cmd in commands:
-                if "route" == cmd["type"] and "remove" == cmd["action"]:
-                    result = self.app._remove_route_via_agent(cmd["ips"])
-                elif "flow" == cmd["type"] and "block" == cmd["action"]:
-                    result = self.app.add_flow_block(cmd["ips"], PRIORITY)
-                else:
+                handler = BATCH_COMMANDS.get((cmd["type"], cmd["action"]))
+                if handler is None:
                     continue
 
-                if "error" in result:
-                    results["error"] = []
-                    results["error"].append(result)
-                else:
-                    results["resp"] = []
-                    results["resp"].append(result)
+                result = handler(self.app, cmd["ips"])
+                (errors if "error" in result else resps).append(result)
 
-            body = json.dumps(results).encode()
+            results = {}
+            if errors:
+                results["error"] = errors
+            if resps:
+                results["resp"] = resps
+            body = orjson.dumps(results)
 
             # checking error
             if "error" in results:
@@ -181,10 +178,10 @@ class RestNBController(ControllerBase):
             else:
                 return Response(content_type="application/json", body=body)
 
-        except json.JSONDecodeError:
-            body = json.dumps({"error": "Invalid JSON in request body"}).encode()
+        except orjson.JSONDecodeError:
+            body = orjson.dumps({"error": "Invalid JSON in request body"})
             return Response(content_type="application/json", body=body, status=400)
         except Exception as e:
-            body = json.dumps({"error": str(e)}).encode()
-            traceback.print_exc()
+            body = orjson.dumps({"error": str(e)})
+            self.logger.exception("batch_flow_route failed: %s", e)
             return Response(content_type="application/json", body=body, status=500)
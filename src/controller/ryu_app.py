@@ -1,11 +1,16 @@
 import logging
 import sys
 import asyncio
+import functools
+import os
+import re
 import threading
 import pathlib
-# from concurrent.futures import ThreadPoolExecutor, thread
+import orjson
+from dataclasses import dataclass, field
+from concurrent.futures import ThreadPoolExecutor
 
-from typing import List
+from typing import Any, Dict, List
 
 from ryu.app.wsgi import WSGIApplication
 from ryu.base import app_manager
@@ -20,6 +25,11 @@ from ryu.ofproto import ofproto_v1_3
 
 from ryu.lib.packet import ethernet, packet, ether_types
 
+try:
+    import uvloop
+except ImportError:
+    uvloop = None
+
 # local imports
 from agent_controller import AsyncAgentController
 from nb_controller import RestNBController
@@ -38,6 +48,45 @@ log_file = log_path / "ryu_app.log"
 
 AGENT_URL = "http://10.0.0.254:8080"
 
+ETH_TYPE_IPV4 = 0x0800
+# seconds to wait for a flow stats reply, below the REST handler's 2s
+FLOW_STATS_TIMEOUT = 1.5
+AGENT_QUEUE_SIZE = 4096  # max route deletes waiting for the agent
+AGENT_COALESCE_WINDOW = 0.01  # seconds queued route deletes are gathered for
+MATCH_CACHE_SIZE = 4096  # max cached ipv4_dst matches
+# workers of the agent loop's default executor
+THREAD_POOL_SIZE = int(os.environ.get("THREAD_POOL_SIZE", "32"))
+
+_OCTET = r"(?:25[0-5]|2[0-4]\d|1\d\d|[1-9]?\d)"
+# an IPv4 address, optionally with a prefix length
+_IPV4_RE = re.compile(rf"{_OCTET}(?:\.{_OCTET}){{3}}(?:/(?:3[0-2]|[12]?\d))?")
+
+
+def _vet_ips(ips):
+    """The entries of ips that are IPv4 addresses or networks, in order"""
+    return [ip for ip in ips if isinstance(ip, str) and _IPV4_RE.fullmatch(ip)]
+
+
+@functools.lru_cache(maxsize=MATCH_CACHE_SIZE)
+def _ipv4_dst_match(parser, ip):
+    """
+    OFPMatch on an IPv4 destination, built once and shared by the flow mods of
+    every switch speaking the same parser
+    """
+    return parser.OFPMatch(eth_type=ETH_TYPE_IPV4, ipv4_dst=ip)
+
+
+@dataclass(slots=True)
+class SwitchState:
+    """A connected switch"""
+
+    datapath: Any
+    dpid_str: str = ""  # zero-padded dpid
+    # instructions shared by all block / route flow mods of the switch
+    drop_inst: Any = None
+    route_inst: Any = None
+    mac_ports: Dict[str, int] = field(default_factory=dict)  # learned mac -> port
+
 
 class AsyncController(app_manager.RyuApp):
     OFP_VERSIONS = [ofproto_v1_3.OFP_VERSION]
@@ -62,9 +111,12 @@ class AsyncController(app_manager.RyuApp):
 
         # ryu related
         self.switches = {}
+        # /api/switches body, rebuilt when a switch connects or disconnects
+        self._switches_json = b'{"switches":[]}'
+        # last flow stats per dpid, a reply replaces the whole list
         self.flow_stats = {}
-        self.mac_ports = {}
-        self.lock = threading.Lock()
+        # futures of outstanding flow stats requests, per dpid, on self.loop
+        self._stats_waiters = {}
         # self.executor = ThreadPoolExecutor(max_workers=10)
         # cache for policy decisions
         self.policy_cache = {}
@@ -79,17 +131,23 @@ class AsyncController(app_manager.RyuApp):
 
         self.agent_controller = None
         self.agent_url = AGENT_URL
+        # route deletes from flow removals, created on the agent loop
+        self._agent_queue = None
 
         try:
-            # Initialize asyncio event loop for async operations
-            self.loop = asyncio.new_event_loop()
+            # Initialize asyncio event loop for async operations, uvloop if
+            # available. Only this loop uses it, the global policy is untouched
+            if uvloop is not None:
+                self.loop = uvloop.new_event_loop()
+            else:
+                self.loop = asyncio.new_event_loop()
             threading.Thread(target=self._run_async_loop, daemon=True).start()
 
             # initialize the sdn controller with in the event loop
             asyncio.run_coroutine_threadsafe(self._init_agent_controller(), self.loop)
 
         except Exception as e:
-            self.logger.error(f"Failed to start Ryu controller: {str(e)}")
+            self.logger.error("Failed to start Ryu controller: %s", e)
             # sys.exit(1)
 
         self.logger.info("Ryu controller started with REST Api")
@@ -98,10 +156,17 @@ class AsyncController(app_manager.RyuApp):
     def _run_async_loop(self):
         try:
             asyncio.set_event_loop(self.loop)
+            self.loop.set_default_executor(
+                ThreadPoolExecutor(
+                    max_workers=THREAD_POOL_SIZE, thread_name_prefix="sdn-agent"
+                )
+            )
+            self._agent_queue = asyncio.Queue(maxsize=AGENT_QUEUE_SIZE)
+            self.loop.create_task(self._agent_worker())
             self.loop.run_forever()
         except Exception as e:
             self.logger.error(
-                f"Failed to setup event loop for SDN agent communication daemon: {str(e)}"
+                "Failed to setup event loop for SDN agent communication daemon: %s", e
             )
 
     async def _init_agent_controller(self):
@@ -111,9 +176,45 @@ class AsyncController(app_manager.RyuApp):
             ).__aenter__()
         except Exception as e:
             self.logger.debug(
-                f"Error starting communication daemon to the SDN agent: {str(e)}"
+                "Error starting communication daemon to the SDN agent: %s", e
             )
 
+    async def _agent_worker(self):
+        """
+        Send route deletes queued by _queue_route_delete to the agent. Deletes
+        queued within AGENT_COALESCE_WINDOW, or while the previous call was in
+        flight, go out as one batch
+        """
+        while True:
+            ips = list(await self._agent_queue.get())
+            await asyncio.sleep(AGENT_COALESCE_WINDOW)
+            while not self._agent_queue.empty():
+                ips.extend(self._agent_queue.get_nowait())
+            # drop duplicates, keeping the order
+            ips = list(dict.fromkeys(ips))
+
+            if self.agent_controller is None:
+                self.logger.debug("controller is None!")
+                continue
+            try:
+                result = await self.agent_controller.batch_delete_routes(ips)
+                self.logger.debug("Route delete result: %s", result)
+            except Exception as e:
+                self.logger.error("Error deleting routes via agent: %s", e)
+
+    def _queue_route_delete(self, ips: List[str]):
+        """
+        Hand a route delete to _agent_worker and return without waiting for
+        the agent, for callers that have no use for the result
+        """
+        self.loop.call_soon_threadsafe(self._put_route_delete, ips)
+
+    def _put_route_delete(self, ips: List[str]):
+        try:
+            self._agent_queue.put_nowait(ips)
+        except asyncio.QueueFull:
+            self.logger.error("Agent queue full, dropping route delete: %s", ips)
+
     # def _process_message(self, msg):
     #     """process incoming messsage from client"""
     #     if not isinstance(msg, dict) or "command" not in msg:
@@ -173,13 +274,13 @@ class AsyncController(app_manager.RyuApp):
 
         try:
             result = future.result(timeout=1)
-            self.logger.debug(f"Route add result: {result}")
+            self.logger.debug("Route add result: %s", result)
             return {"success": "Requested operation is done."}
         except asyncio.TimeoutError as e:
-            self.logger.debug(f"Batch_add_routes timed out: {str(e)}")
+            self.logger.debug("Batch_add_routes timed out: %s", e)
             return {"error": "Operation timed out."}
         except Exception as e:
-            self.logger.debug(f"Error adding route: {str(e)}")
+            self.logger.debug("Error adding route: %s", e)
             return {"error": "Adding route failed."}
 
     def _remove_route_via_agent(self, ips: List[str]):
@@ -191,19 +292,23 @@ class AsyncController(app_manager.RyuApp):
             self.logger.debug("controller is None!")
             return {"error": "Interal Error!"}
 
+        ips = _vet_ips(ips)
+        if not ips:
+            return {"error": "no valid ips"}
+
         # run async in another thread that maintains the async loop
         coro = self.agent_controller.batch_delete_routes(ips)
         future = asyncio.run_coroutine_threadsafe(coro, self.loop)
 
         try:
             result = future.result(timeout=1)
-            self.logger.debug(f"Route delete result: {result}")
+            self.logger.debug("Route delete result: %s", result)
             return {"success": "Requested operation is done."}
         except asyncio.TimeoutError as e:
-            self.logger.debug(f"Batch_delete_routes timed out: {str(e)}")
+            self.logger.debug("Batch_delete_routes timed out: %s", e)
             return {"error": "Operation timed out."}
         except Exception as e:
-            self.logger.debug(f"Error deleting route: {str(e)}")
+            self.logger.debug("Error deleting route: %s", e)
             return {"error": "Deleting route failed"}
 
     def _add_flow(
@@ -232,24 +337,35 @@ class AsyncController(app_manager.RyuApp):
             )
         datapath.send_msg(mod)
 
-    def _add_flow_with_notification(
+    def _send_msgs(self, datapath, msgs):
+        """
+        Send messages to a switch in one write, instead of one send_msg each
+        """
+        bufs = []
+        for msg in msgs:
+            datapath.set_xid(msg)
+            msg.serialize()
+            bufs.append(msg.buf)
+        if bufs:
+            datapath.send(b"".join(bufs))
+
+    def _flow_mod_with_notification(
         self,
         datapath,
         priority,
         match,
-        actions,
+        inst,
         buffer_id=None,
         idle_timeout=0,
         hard_timeout=0,
     ):
         """
+        Build a flow mod that notifies on removal, sending is up to the caller.
         Only idle timeout will be used to have flow removed
         """
         ofproto = datapath.ofproto
         parser = datapath.ofproto_parser
 
-        inst = [parser.OFPInstructionActions(ofproto.OFPIT_APPLY_ACTIONS, actions)]
-
         # enable flow removal notifications
         flags = ofproto.OFPFF_SEND_FLOW_REM
 
@@ -274,10 +390,7 @@ class AsyncController(app_manager.RyuApp):
                 idle_timeout=idle_timeout,
                 hard_timeout=hard_timeout,
             )
-        datapath.send_msg(mod)
-        self.logger.debug(
-            f"Flow added to switch {datapath.id} with removal nofification"
-        )
+        return mod
         # self.logger.debug(f"Flow added to switch {datapath.id}")
 
     ######################## ryu event handlers #################################
@@ -289,9 +402,19 @@ class AsyncController(app_manager.RyuApp):
         parser = datapath.ofproto_parser
         dpid = datapath.id
 
-        # store switch
-        self.switches[dpid] = {"datapath": datapath, "ports": {}}
-        self.logger.info(f"Switch connected: {dpid}")
+        # store switch, with the padded dpid string used by packet-in and the
+        # constant instructions of block flows and route flows (out port 1)
+        apply = ofproto.OFPIT_APPLY_ACTIONS
+        self.switches[dpid] = SwitchState(
+            datapath=datapath,
+            dpid_str=format(dpid, "d").zfill(16),
+            drop_inst=[parser.OFPInstructionActions(apply, [])],
+            route_inst=[
+                parser.OFPInstructionActions(apply, [parser.OFPActionOutput(port=1)])
+            ],
+        )
+        self._switches_json = orjson.dumps({"switches": list(self.switches)})
+        self.logger.info("Switch connected: %s", dpid)
 
         # install talbe miss flow entry
         match = parser.OFPMatch()
@@ -332,18 +455,19 @@ class AsyncController(app_manager.RyuApp):
         dst = eth.dst
         src = eth.src
 
-        dpid = format(datapath.id, "d").zfill(16)
-        self.mac_ports.setdefault(dpid, {})
+        switch = self.switches.get(datapath.id)
+        if switch is None:
+            # not registered yet, or already disconnected
+            return
+        dpid = switch.dpid_str
+        mac_ports = switch.mac_ports
 
-        self.logger.debug(f"packet in {dpid} {src} {dst} {in_port}")
+        self.logger.debug("packet in %s %s %s %s", dpid, src, dst, in_port)
 
         # learn a mac address to avoid FLOOD next time.
-        self.mac_ports[dpid][src] = in_port
+        mac_ports[src] = in_port
 
-        if dst in self.mac_ports[dpid]:
-            out_port = self.mac_ports[dpid][dst]
-        else:
-            out_port = ofproto.OFPP_FLOOD
+        out_port = mac_ports.get(dst, ofproto.OFPP_FLOOD)
 
         actions = [parser.OFPActionOutput(out_port)]
 
@@ -393,8 +517,16 @@ class AsyncController(app_manager.RyuApp):
                 }
             )
 
-        with self.lock:
-            self.flow_stats[dpid] = flows
+        self.flow_stats[dpid] = flows
+
+        # wake up request_flow_stats_async, which waits on the agent loop
+        self.loop.call_soon_threadsafe(self._flow_stats_ready, dpid, flows)
+
+    def _flow_stats_ready(self, dpid, flows):
+        """Resolve the outstanding flow stats request of dpid, on self.loop"""
+        fut = self._stats_waiters.pop(dpid, None)
+        if fut is not None and not fut.done():
+            fut.set_result(flows)
 
     @set_ev_cls(ofp_event.EventOFPFlowRemoved, MAIN_DISPATCHER)
     def flow_removed_handler(self, ev):
@@ -413,15 +545,11 @@ class AsyncController(app_manager.RyuApp):
             reason = "UNKOWN"
 
         if reason in ["IDLE_TIMEOUT", "HARD_TIMEOUT"]:
-            match = msg.match
-            ipv4_dst = [match.get("ipv4_dst", None)]
+            ipv4_dst = msg.match.get("ipv4_dst", None)
 
             if ipv4_dst:
-                # call the route deleting
-                try:
-                    self._remove_route_via_agent(ipv4_dst)
-                except Exception as e:
-                    self.logger.error(f"Error deleting routes via agent: {e}")
+                # delete the route without blocking the event handler
+                self._queue_route_delete([ipv4_dst])
 
         self.logger.debug(
             "Flow removed: "
@@ -459,30 +587,37 @@ class AsyncController(app_manager.RyuApp):
         datapath = ev.datapath
         if ev.state == DEAD_DISPATCHER:
             # switch disconnected
-            self.logger.info(f"Switch {datapath.id} disconnected")
+            self.logger.info("Switch %s disconnected", datapath.id)
             # remove it from the switches
             self.switches.pop(datapath.id, None)
+            self._switches_json = orjson.dumps({"switches": list(self.switches)})
 
     ######################## REST API handlers #################################
     async def request_flow_stats_async(self, dpid):
         if dpid not in self.switches:
             return {"error": f"Switch {dpid} not found"}
 
-        datapath = self.switches[dpid]["datapath"]
-        ofproto = datapath.ofproto
-        parser = datapath.ofproto_parser
+        # concurrent callers share one outstanding request
+        fut = self._stats_waiters.get(dpid)
+        if fut is None:
+            datapath = self.switches[dpid].datapath
+            parser = datapath.ofproto_parser
 
-        req = parser.EventOFPFlowStatsReply(datapath)
-        datapath.send_msg(req)
+            fut = self.loop.create_future()
+            self._stats_waiters[dpid] = fut
+            datapath.send_msg(parser.OFPFlowStatsRequest(datapath))
 
-        # wait for the stats to be updated ( with timtouts)
-        for _ in range(5):  # 5 retries
-            await asyncio.sleep(0.5)
-            with self.lock:
-                if dpid in self.flow_stats:
-                    return {"flows": self.flow_stats[dpid]}
+        # wait for flow_stats_reply_handler to resolve it
+        try:
+            flows = await asyncio.wait_for(
+                asyncio.shield(fut), timeout=FLOW_STATS_TIMEOUT
+            )
+        except asyncio.TimeoutError:
+            if self._stats_waiters.get(dpid) is fut:
+                del self._stats_waiters[dpid]
+            return {"error": "Timeout waiting for flow stats"}
 
-        return {"error": "Timeout waiting for flow stats"}
+        return {"flows": flows}
 
     def add_flow_route(
         self, ips: List[str], nexthop: str, priority: int, add_route: bool = True
@@ -493,34 +628,48 @@ class AsyncController(app_manager.RyuApp):
         Note: the validity of data shoudl be done by the handler
 
         """
+        ips = _vet_ips(ips)
+        if not ips:
+            return {"error": "no valid ips"}
+
         error = False
         # add route to via the agent
         if add_route:
             try:
                 self._add_route_via_agent(ips=ips, nexthop=nexthop)
             except Exception as e:
-                self.logger.error(f"Error adding routes via agent: {e}")
+                self.logger.error("Error adding routes via agent: %s", e)
                 error = True
 
         # prepare for adding the flow
-        for dpid in self.switches.keys():
-            dp = self.switches[dpid].get("datapath", None)
+        for switch in self.switches.values():
+            dp = switch.datapath
             if dp is None:
                 error = True
                 self.logger.error("Invalid dpid")
 
                 continue
 
+            parser = dp.ofproto_parser
+            inst = switch.route_inst
+            mods = []
             for ip in ips:
-                match = dp.ofproto_parser.OFPMatch(eth_type=0x0800, ipv4_dst=ip)
-                actions = [dp.ofproto_parser.OFPActionOutput(port=1)]
-                self._add_flow_with_notification(
-                    dp,
-                    priority=priority,
-                    match=match,
-                    actions=actions,
-                    idle_timeout=self.idle_timeout,
+                match = _ipv4_dst_match(parser, ip)
+                mods.append(
+                    self._flow_mod_with_notification(
+                        dp,
+                        priority=priority,
+                        match=match,
+                        inst=inst,
+                        idle_timeout=self.idle_timeout,
+                    )
                 )
+            self._send_msgs(dp, mods)
+            self.logger.debug(
+                "%s flows added to switch %s with removal nofification",
+                len(mods),
+                dp.id,
+            )
 
         if error:
             return {"error": "Interal error"}
@@ -533,25 +682,38 @@ class AsyncController(app_manager.RyuApp):
 
         Flows to block a certain ip has a lower priority of 70
         """
+        ips = _vet_ips(ips)
+        if not ips:
+            return {"error": "no valid ips"}
 
         error = False
         # prepare for addding the flow
-        for dpid in self.switches.keys():
-            dp = self.switches[dpid].get("datapath", None)
+        for switch in self.switches.values():
+            dp = switch.datapath
             if dp is None:
                 self.logger.error("Invalid dpid")
                 error = True
                 continue
 
-            actions = []
+            parser = dp.ofproto_parser
+            inst = switch.drop_inst
+            mods = []
             for ip in ips:
-                match = dp.ofproto_parser.OFPMatch(eth_type=0x0800, ipv4_dst=ip)
-                self._add_flow_with_notification(
-                    dp,
-                    priority=priority,
-                    match=match,
-                    actions=actions,
+                match = _ipv4_dst_match(parser, ip)
+                mods.append(
+                    self._flow_mod_with_notification(
+                        dp,
+                        priority=priority,
+                        match=match,
+                        inst=inst,
+                    )
                 )
+            self._send_msgs(dp, mods)
+            self.logger.debug(
+                "%s flows added to switch %s with removal nofification",
+                len(mods),
+                dp.id,
+            )
 
         if error:
             return {"error": "Interal error"}
@@ -562,27 +724,36 @@ class AsyncController(app_manager.RyuApp):
         """
         Actual function to be called by rest api handler to block a dest ip
         """
+        ips = _vet_ips(ips)
+        if not ips:
+            return {"error": "no valid ips"}
+
         error = False
         # prepare for removing a flow
-        for dpid in self.switches.keys():
-            dp = self.switches[dpid].get("datapath", None)
+        for switch in self.switches.values():
+            dp = switch.datapath
             if dp is None:
                 self.logger.error("Invalid dpid")
                 error = True
                 continue
 
-            self.logger.debug(f"gotten :{ips}")
+            self.logger.debug("gotten :%s", ips)
 
+            parser = dp.ofproto_parser
+            ofproto = dp.ofproto
+            mods = []
             for ip in ips:
-                match = dp.ofproto_parser.OFPMatch(eth_type=0x0800, ipv4_dst=ip)
-                mod = dp.ofproto_parser.OFPFlowMod(
-                    datapath=dp,
-                    command=dp.ofproto.OFPFC_DELETE,
-                    out_port=dp.ofproto.OFPP_ANY,
-                    out_group=dp.ofproto.OFPG_ANY,
-                    match=match,
+                match = _ipv4_dst_match(parser, ip)
+                mods.append(
+                    parser.OFPFlowMod(
+                        datapath=dp,
+                        command=ofproto.OFPFC_DELETE,
+                        out_port=ofproto.OFPP_ANY,
+                        out_group=ofproto.OFPG_ANY,
+                        match=match,
+                    )
                 )
-                dp.send_msg(mod)
+            self._send_msgs(dp, mods)
 
         if error:
             return {"error": "Internal error"}
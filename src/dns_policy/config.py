@@ -1,7 +1,27 @@
 from pathlib import Path
 import pathlib
-from typing import Any, Dict, List, Tuple
-import ipaddress
+from typing import Any, Dict, List
+import functools
+import itertools
+import re
+import socket
+
+# /domain/value of the address, block, route and server directives; values are
+# stripped already, so only the whitespace around the domain is left to skip.
+# Domains are lower-cased by the parsers, dns names are case-insensitive
+_SLASHED = re.compile(r"/\s*(?P<domain>[^/]*?)\s*/\s*(?P<rhs>.*)")
+
+
+@functools.lru_cache(maxsize=2048)
+def _valid_ip(ip: str) -> bool:
+    """Whether ip is an IPv4 or IPv6 address, checked by inet_pton"""
+    for family in (socket.AF_INET, socket.AF_INET6):
+        try:
+            socket.inet_pton(family, ip)
+            return True
+        except (OSError, ValueError):
+            pass
+    return False
 
 
 class ConfigManager:
@@ -42,15 +62,16 @@ class ConfigManager:
         self.route_rule = []
 
         # define valid prefixes in the config file
-        # and the functions to parse the line for each prefix
+        # and the functions to parse the line for each prefix,
+        # each called with (line_num, value)
         self.valid_prefixes = {
             "listen-address": self._parse_listen_address_line,
             "listen-port": self._parse_listen_port_line,
             "cache-size": self._parse_cache_size_line,
-            "server": self._batch_server_line,
-            "address": self._batch_address_line,
-            "block": self._batch_block_line,
-            "route": self._batch_route_line,
+            "server": self._handle_server_line,
+            "address": self._handle_address_line,
+            "block": self._handle_block_line,
+            "route": self._handle_route_line,
         }
 
     def parse_file(self, file_path: str = "") -> Dict[str, Any]:
@@ -99,41 +120,41 @@ class ConfigManager:
     def _parse_file(self, confs: List[Path]) -> Dict[str, Any]:
         """
         Take any file in base folder as config file.
-        Read all lines first. However, only store ones that doesnot start with "#"
+        Each file is read whole, then its lines are parsed in a single pass, each
+        handed to its directive's handler. Lines starting with "#" are skipped.
+        All errors found are raised together once every line is parsed
         """
-        # create lists to store lines for each prefix
-        # batches: Dict[str, List[str]] = {prefix: [] for prefix in self.valid_prefixes}
-        batches = {prefix: [] for prefix in self.valid_prefixes}
-        errors = []  # record all the syntax errors found
+        valid_prefixes = self.valid_prefixes
+        errors = []  # record all the errors found
 
         line_num = 0  # keep line number to track error
         for conf in confs:
+            # read in one go, lines are then split from memory
             with open(conf, "r") as f:
-                for line in f:
-                    line_num += 1
-                    line = line.strip()
-
-                    # skip comments
-                    if line.startswith("#") or (not line):
-                        continue
-                    # extract directive and then save each line
-                    equals_pos = line.find("=")
-                    if equals_pos == -1:
-                        errors.append(
-                            (line_num, line, "Missing '=' in configuration line")
-                        )
-                        continue
-
-                    directive = line[:equals_pos]
-                    value = line[equals_pos + 1 :].strip()
-
-                    # check if directive is valid
-                    if directive in self.valid_prefixes:
-                        batches[directive].append((line_num, value))
-                    else:
-                        errors.append(
-                            (line_num, line, f"Unknown directive: {directive}")
-                        )
+                lines = f.read().splitlines()
+            for line in lines:
+                line_num += 1
+                line = line.strip()
+
+                # skip comments
+                if not line or line[0] == "#":
+                    continue
+                # extract directive and then parse the line right away
+                directive, sep, value = line.partition("=")
+                if not sep:
+                    errors.append((line_num, line, "Missing '=' in configuration line"))
+                    continue
+
+                # check if directive is valid
+                handler = valid_prefixes.get(directive)
+                if handler is not None:
+                    # invalid values are reported with the syntax errors
+                    try:
+                        handler(line_num, value.strip())
+                    except ValueError as e:
+                        errors.append((line_num, line, str(e)))
+                else:
+                    errors.append((line_num, line, f"Unknown directive: {directive}"))
 
         if errors:
             error_message = [
@@ -141,31 +162,19 @@ class ConfigManager:
             ]
             raise ValueError("Configuration errors found\n" + "\n".join(error_message))
 
-        # now, parse and verify with each spective directive
-        for prefix, handler in self.valid_prefixes.items():
-            if batches[prefix]:
-                handler(batches[prefix])
-
         return self.config
 
-    def _parse_listen_address_line(self, line: List[Tuple[int, str]]):
+    def _parse_listen_address_line(self, line_num: int, value: str):
         """check validity of listen address"""
-        # get line number, and value
-        line_num, value = line[0]
-
         # treat the value as an ip address
-        try:
-            ipaddress.ip_address(value)  # only validate here
-            self.config["listen_address"] = value
-        except ValueError:
+        if not _valid_ip(value):
             raise ValueError(
                 f"Line {line_num}: Invalid IP address in listen-address: {value}"
             )
+        self.config["listen_address"] = value
 
-    def _parse_listen_port_line(self, line: List[Tuple[int, str]]):
+    def _parse_listen_port_line(self, line_num: int, value: str):
         """check validity of listen port"""
-        line_num, value = line[0]
-
         try:
             port = int(value)
         except ValueError:
@@ -178,15 +187,13 @@ class ConfigManager:
                 f":Line {line_num}: Port must be between 1 and 65535: {value}"
             )
 
-    def _parse_cache_size_line(self, line: List[Tuple[int, str]]):
+    def _parse_cache_size_line(self, line_num: int, value: str):
         """
         Parse the cache size setting. Maxsize is 65536, but
         coule be larger.
         eg:
             cache_size=10000
         """
-        line_num, value = line[0]
-
         try:
             cache_size = int(value)
         except ValueError:
@@ -199,76 +206,66 @@ class ConfigManager:
                 f":Line {line_num}: Cache size must be between 0 and 65535: {value}"
             )
 
-    def _batch_server_line(self, line: List[Tuple[int, str]]):
+    def _handle_server_line(self, line_num: int, value: str):
         """
         check validity of server address.
         There are two situations:
             a. server=8.8.8.8
             b. server=/google.com/1.1.1.3
         """
+        # if the value is a valid ip address, then it is a server
+        if not value.startswith("/"):
+            if not _valid_ip(value):
+                raise ValueError(f"Line {line_num}: Invalid IP address:  {value}.")
+            self.config["default_upstreams"].append(value)
+        else:
+            # check if the value is valid
+            self._parse_domain_server(value)
 
-        for line_num, value in line:
-            # if the value is a valid ip address, then it is a server
-            if not value.startswith("/"):
-                ip = value.strip()
-                try:
-                    ipaddress.ip_address(ip)
-                    self.config["default_upstreams"].append(ip)
-                except ValueError as e:
-                    raise ValueError(f"Line {line_num}: Invalid IP address:  {e}.")
-            else:
-                # check if the value is valid
-                self._parse_domain_server(value)
-
-    def _batch_address_line(self, line: List[Tuple[int, str]]):
+    def _handle_address_line(self, line_num: int, value: str):
         """
-        Batch proceesing the address line, that returns static ips
+        Proceesing an address line, that returns static ips
         """
-        for line_num, value in line:
-            try:
-                self._parse_address_line(value)
-            except ValueError as e:
-                raise ValueError(f"Line {line_num}, Invalid address directive:  {e}.")
+        try:
+            self._parse_address_line(value)
+        except ValueError as e:
+            raise ValueError(f"Line {line_num}, Invalid address directive:  {e}.")
 
     def _parse_address_line(self, value: str):
-        second_slash = value.find("/", 1)
-        if second_slash == -1:
+        m = _SLASHED.match(value)
+        if m is None:
             raise ValueError("Missing '/'.")
 
-        domain = value[1:second_slash].strip()
-        ip = value[second_slash + 1 :].strip()
+        domain, ip = m["domain"].lower(), m["rhs"]
         if not domain:
             raise ValueError("Empty domain in address directive.")
 
         if not ip:
             raise ValueError("Empty ip in address directive.")
 
-        try:
-            ipaddress.ip_address(ip)
-            rule = {"domain": domain, "address": ip}
-            self.static_rule.append(rule)
-        except ValueError as e:
-            raise ValueError(f"Invalid static ip address: {e}.")
+        if not _valid_ip(ip):
+            raise ValueError(f"Invalid static ip address: {ip}.")
+        rule = {"domain": domain, "address": ip}
+        self.static_rule.append(rule)
 
-    def _batch_block_line(self, line: List[Tuple[int, str]]):
+    def _handle_block_line(self, line_num: int, value: str):
         """
-        Batching parsing block lines
+        Parsing a block line
         """
-        for line_num, value in line:
-            try:
-                self._parse_block_line(value)
-            except ValueError as e:
-                raise ValueError(f"Line {line_num}, Invalid block:  {e}.")
+        try:
+            self._parse_block_line(value)
+        except ValueError as e:
+            raise ValueError(f"Line {line_num}, Invalid block:  {e}.")
 
     def _parse_block_line(self, value: str):
         """
         Parse each block line
         """
-        second_slash = value.find("/", 1)
-        if second_slash == -1:
+        m = _SLASHED.match(value)
+        if m is None:
             raise ValueError("Missing '/'.")
 
-        domain = value[1:second_slash].strip()
+        domain = m["domain"].lower()
         if not domain:
             raise ValueError("Empty domain in block directive.")
 
@@ -276,78 +273,67 @@ class ConfigManager:
         self.block_rule.append(rule)
         # self._add_or_replace(domain, rule)
 
-    def _batch_route_line(self, line: List[Tuple[int, str]]):
+    def _handle_route_line(self, line_num: int, value: str):
         """
-        Batch processing route line
+        Processing a route line
         """
-        for line_num, value in line:
-            try:
-                self._parse_route_line(line_num, value)
-            except ValueError as e:
-                raise ValueError(f"Line {line_num}, Invalid route:  {e}.")
+        try:
+            self._parse_route_line(line_num, value)
+        except ValueError as e:
+            raise ValueError(f"Line {line_num}, Invalid route:  {e}.")
 
     def _parse_route_line(self, line_num: int, value: str):
-        second_slash = value.find("/", 1)
-        if second_slash == -1:
+        m = _SLASHED.match(value)
+        if m is None:
             raise ValueError(f"Wrong format, missing '/' in line {line_num}.")
 
-        domain = value[1:second_slash].strip()
-        gw = value[second_slash + 1 :].strip()
+        domain, gw = m["domain"].lower(), m["rhs"]
         if not domain:
             raise ValueError("Empty domain in route directive.")
         if not gw:
             raise ValueError("Empty gateway in route directive.")
 
-        try:
-            ipaddress.ip_address(gw)
-            rule = {"domain": domain, "route": gw, "dbr": True}
-            self.route_rule.append(rule)
-            # self._add_or_replace(domain, rule)
-        except ValueError:
+        if not _valid_ip(gw):
             raise ValueError(f"Invalid gateway in route directive: {gw}.")
+        rule = {"domain": domain, "route": gw, "dbr": True}
+        self.route_rule.append(rule)
+        # self._add_or_replace(domain, rule)
 
     def _parse_domain_server(self, value: str):
-        second_slash = value.find("/", 1)
-        if second_slash == -1:
+        m = _SLASHED.match(value)
+        if m is None:
             raise ValueError("Empty domain in server directive.")
 
-        domain = value[1:second_slash].strip()
         # upstream specified
-        upstream = value[second_slash + 1 :].strip()
+        domain, upstream = m["domain"].lower(), m["rhs"]
         if not domain:
             raise ValueError("Empty domain in server directive.")
         if not upstream:
             raise ValueError("Empty upstream in server directive.")
 
-        try:
-            ipaddress.ip_address(upstream)
-            # NOTE: using list to store specified upstream, to support multiple
-            # upstresm in the future
-            rule = {"domain": domain, "upstream": [upstream]}
-            self.server_rule.append(rule)
-            # self._add_or_replace(domain, rule)
-        except ValueError:
+        if not _valid_ip(upstream):
             raise ValueError(f"Invalid upstream in server directive: {upstream}.")
+        # NOTE: using list to store specified upstream, to support multiple
+        # upstresm in the future
+        rule = {"domain": domain, "upstream": [upstream]}
+        self.server_rule.append(rule)
+        # self._add_or_replace(domain, rule)
 
     def _merge_rules(self):
         """
         Consider setting upstream server and route policy might be different lines, this
-        function merges the rules
+        function merges the rules. Rules are keyed by domain, so each one is merged
+        in a single lookup, and the per-directive rule lists are left untouched
         """
-        all_lists = (
-            self.server_rule + self.static_rule + self.block_rule + self.route_rule
-        )
-
-        for rule in all_lists:
-            index = -1
-            for i, existing in enumerate(self.config["rules"]):
-                if rule["domain"] == existing["domain"]:
-                    index = i
-                    break
-            if index >= 0:
-                self.config["rules"][index] |= rule
-            else:
-                self.config["rules"].append(rule)
+        merged: Dict[str, Dict] = {}
+        for rule in itertools.chain(
+            self.server_rule, self.static_rule, self.block_rule, self.route_rule
+        ):
+            domain = rule["domain"]
+            existing = merged.get(domain)
+            merged[domain] = existing | rule if existing else dict(rule)
+
+        self.config["rules"] = list(merged.values())
 
         """
         The rules will look like:
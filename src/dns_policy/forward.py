@@ -1,11 +1,17 @@
 import dns.message
 import dns.rcode
 import dns.asyncquery
+import dns.exception
+import dns.flags
+import dns.name
 import dns.rdatatype
 import dns.rrset
 import logging
 import asyncio
-from cachetools import TLRUCache
+import functools
+import struct
+import sys
+import time
 
 from typing import (
     Any,
@@ -24,6 +30,22 @@ from trie import DomainTrie
 
 logger = logging.getLogger(__name__)
 
+NXDOMAIN_TEMPLATE_CACHE_SIZE = 4096
+
+
+@functools.lru_cache(maxsize=NXDOMAIN_TEMPLATE_CACHE_SIZE)
+def _nxdomain_template(qname_wire: bytes, qtype: int, rdclass: int, rd: bool) -> bytes:
+    """
+    NXDOMAIN response wire for a question, only the id is left for the caller
+    to patch in
+    """
+    qname, _ = dns.name.from_wire(qname_wire, 0)
+    query = dns.message.make_query(qname, qtype, rdclass)
+    query.flags = dns.flags.RD if rd else 0
+    resp = dns.message.make_response(query)
+    resp.set_rcode(dns.rcode.NXDOMAIN)
+    return resp.to_wire()
+
 
 """ 
 As of 6.0.0b4 cachetools provides a ttlcache that support custom time calculation, called 
@@ -129,17 +151,17 @@ class DNSForwarder:
         self.cache_ttl = cache_ttl
         self.timeout = timeout
         self.response_cb: Optional[OnResponseCallback] = None
-        self.MAX_DNS_TTL = 2_147_483_647
 
         # transport handles
         self.udp_transport = None
 
         try:
             # Initialize cache
-            # domain/ip cache
-            self.cache = TLRUCache(maxsize=cache_size, ttu=self._my_ttu)
-            ### NOTE: cache should include static routes immediately, with max ttl
-            self.block_cache: Dict = {}
+            # domain/ip cache, (qname, qtype) -> (wire, expires_at), expired
+            # entries are dropped on lookup, the oldest are evicted when full
+            self.cache: Dict[Tuple[str, int], Tuple[bytes, float]] = {}
+            # static records, never expire nor get evicted or purged
+            self.static_cache: Dict[Tuple[str, int], bytes] = {}
 
             # cname cache
             # self.cname_cache = TLRUCache(maxsize=5000, ttu=self._my_ttu)
@@ -155,9 +177,25 @@ class DNSForwarder:
             f"Async DNS Forwarder initialzed, using upstreams: {self.upstreams}"
         )
 
-    def _my_ttu(self, _key, value, now):
-        # value is a Tuple(value, ttu)
-        return now + value[1]
+    def _cache_get(self, cache: Dict, key: Tuple[str, int]) -> Optional[bytes]:
+        """Cached wire of key, None if it's missing or expired"""
+        entry = cache.get(key)
+        if entry is None:
+            return None
+        if entry[1] > time.monotonic():
+            return entry[0]
+        del cache[key]
+        return None
+
+    def _cache_put(
+        self, cache: Dict, key: Tuple[str, int], wire: bytes, ttl: float
+    ) -> None:
+        """Cache wire for ttl seconds, evicting the oldest entry when full"""
+        # re-inserted keys move to the end of the eviction order
+        cache.pop(key, None)
+        cache[key] = (wire, time.monotonic() + ttl)
+        if len(cache) > self.cache_size:
+            del cache[next(iter(cache))]
 
     async def handle_request(
         self,
@@ -171,8 +209,9 @@ class DNSForwarder:
             query = dns.message.from_wire(data)
             query_id = query.id
             qname = query.question[0].name.to_text()
-            if qname.endswith("."):
-                qname = qname[:-1]
+            # lower-cased as the rules are, and interned, repeated queries reuse
+            # the str and its cached hash
+            qname = sys.intern((qname[:-1] if qname.endswith(".") else qname).lower())
             qtype = query.question[0].rdtype
             # qclass = query.question[0].rdclass
 
@@ -181,14 +220,6 @@ class DNSForwarder:
             # check domain trie for rule
             rule, _ = self.domain_trie.lookup(qname)
 
-            # check block cache
-            # if qname in self.block_cache:
-            #     logger.info(f"Received block cache hit for {qname}")
-            #     # return empty response
-            #     nresp = self.make_NXDOMAIN_response(query)
-            #     transport.sendto(empty_resp.to_wire(), client_addr)
-            #     return
-
             # check if v6, currently ignore v6
             if qtype == dns.rdatatype.AAAA:
                 logger.info(f"Received AAAA type query for {qname}, ignoring")
@@ -196,30 +227,29 @@ class DNSForwarder:
                 transport.sendto(empty_resp.to_wire(), client_addr)
                 return
             elif qtype == dns.rdatatype.PTR and qname.endswith(".10.in-addr.arpa"):
-                nx_resp = self.make_NXDOMAIN_response(query=query)
-                transport.sendto(nx_resp.to_wire(), client_addr)
+                transport.sendto(self._nxdomain_wire(query), client_addr)
                 return
 
             resp = None
 
             # check cache and reply to client
             # cached are statics, block and normal ones
-            cached_resp = self.cache.get((qname, qtype))
-            if cached_resp:  # return te cached resp
-                logger.info(f"Cache hit for {qname} with cache: {cached_resp}")
-                # cached is a tuple (resp, ttl)
-                resp = dns.message.from_wire(cached_resp[0].to_wire())
-                resp.id = query_id
+            cached_wire = self.get_cached((qname, qtype))
+            if cached_wire:  # return te cached resp
+                logger.info(f"Cache hit for {qname}")
+                # reply with the cached wire form, only the 2 byte id at its
+                # start needs to be patched
                 if "block" not in rule:
-                    transport.sendto(resp.to_wire(), client_addr)
+                    wire = bytearray(cached_wire)
+                    struct.pack_into("!H", wire, 0, query_id)
+                    transport.sendto(wire, client_addr)
                     return
 
             # check if rule is block, and it's not cached or cached ttl is expired
             if "block" in rule:
                 # return NXDOMAIN immediately, and then resolve the ip,
                 # and block the resolved ip
-                nx_resp = self.make_NXDOMAIN_response(query)
-                transport.sendto(nx_resp.to_wire(), client_addr)
+                transport.sendto(self._nxdomain_wire(query), client_addr)
 
             # value of this key is a list of upstream(s)
             upstream = rule.get("upstream", self.upstreams)
@@ -253,29 +283,35 @@ class DNSForwarder:
             logger.error(f"Error handling request: {str(e)}")
             raise
 
-    def _extract_A_records(self, resp: dns.message.Message) -> List[str]:
+    def _nxdomain_wire(self, query: dns.message.Message) -> bytearray:
         """
-        Extract all A records from a dns response message, together with ttls
+        NXDOMAIN response wire for query, from the per question template with
+        the query id patched in
         """
-        ips = [
-            rr.address
-            for rrset in resp.answer
-            if rrset.rdtype == dns.rdatatype.A
-            for rr in rrset
-        ]
-        logger.debug(f"Extracted A records from response: {ips}")
-        return ips
+        question = query.question[0]
+        wire = bytearray(
+            _nxdomain_template(
+                question.name.to_wire(),
+                question.rdtype,
+                question.rdclass,
+                bool(query.flags & dns.flags.RD),
+            )
+        )
+        struct.pack_into("!H", wire, 0, query.id)
+        return wire
 
-    def _extract_A_records_with_ttl(self, resp: dns.message.Message) -> List[Tuple]:
+    def _extract_A_records(
+        self, resp: dns.message.Message, with_ttl: bool = False, _A=dns.rdatatype.A
+    ) -> Union[List[str], List[Tuple[str, int]]]:
         """
-        Extract all A records from a dns response message, together with ttls
+        Extract all A records from a dns response message, as (ip, ttl) tuples
+        if with_ttl is set
         """
-        ips = [
-            (rr.address, rrset.ttl)
-            for rrset in resp.answer
-            if rrset.rdtype == dns.rdatatype.A
-            for rr in rrset
-        ]
+        answers = [rrset for rrset in resp.answer if rrset.rdtype == _A]
+        if with_ttl:
+            ips = [(rr.address, rrset.ttl) for rrset in answers for rr in rrset]
+        else:
+            ips = [rr.address for rrset in answers for rr in rrset]
         logger.debug(f"Extracted A records from response: {ips}")
         return ips
 
@@ -291,13 +327,15 @@ class DNSForwarder:
         if not response.answer:
             return
 
-        for rrset in response.answer:
-            if rrset.rdtype == dns.rdatatype.A:
-                ttl = rrset.ttl
+        # an explicit ttl wins over the answer's
+        if ttl == -1:
+            for rrset in response.answer:
+                if rrset.rdtype == dns.rdatatype.A:
+                    ttl = rrset.ttl
 
         if ttl != -1:
-            # add cache
-            self.cache[(qname, qtype)] = (response, ttl)
+            # add cache, with the wire form cache hits are answered from
+            self._cache_put(self.cache, (qname, qtype), response.to_wire(), ttl)
             # logger.debug(f"Cached {qname}: {response}")
 
     def _add_cache_with_ttl(
@@ -320,32 +358,54 @@ class DNSForwarder:
                             ttl = rrset.ttl
 
         # add cache
-        self.cache[(qname, qtype)] = (response, ttl)
+        self._cache_put(self.cache, (qname, qtype), response.to_wire(), ttl)
         # logger.debug(f"Cached {qname}: {response}")
 
     def purge_cache(self):
         """
-        Iterate through the cache, purge any that is not static cache
+        Purge the cache, static records are kept
         """
-        for key, val in self.cache.items():
-            if val[1] != self.MAX_DNS_TTL:
-                del self.cache[key]
+        self.cache.clear()
 
     async def _forward_query(
         self, query: dns.message.Message, upstreams: List[str]
     ) -> dns.message.Message:
-        for upstream in upstreams:
-            try:
-                # return value is a tuple, (dns.message, bool)
-                return await dns.asyncquery.udp(
+        """
+        Race all upstreams, the first successful response wins and the
+        rest of the queries are cancelled
+        """
+        tasks = {
+            asyncio.create_task(
+                dns.asyncquery.udp(
                     query, upstream, timeout=self.timeout, port=self.upstream_port
                 )
-            except asyncio.TimeoutError:
-                logger.warning(f"Timeout from upstream {upstream}, will try next one")
-                continue
-            except Exception as e:
-                logger.error(f"Error forwarding to {upstream}: {str(e)}")
-                continue
+            ): upstream
+            for upstream in upstreams
+        }
+        pending = set(tasks)
+        try:
+            while pending:
+                done, pending = await asyncio.wait(
+                    pending, return_when=asyncio.FIRST_COMPLETED
+                )
+                # every finished task is read, so no failure goes unretrieved
+                resp = None
+                for task in done:
+                    try:
+                        result = task.result()
+                    except dns.exception.Timeout:
+                        logger.warning(f"Timeout from upstream {tasks[task]}")
+                    except Exception as e:
+                        logger.error(f"Error forwarding to {tasks[task]}: {str(e)}")
+                    else:
+                        if resp is None:
+                            resp = result
+                if resp is not None:
+                    return resp
+        finally:
+            # the slower upstreams are not needed any more
+            for task in pending:
+                task.cancel()
         # if program gets here, meaning that all upstream failed
         logger.error("All upstreams failed")
 
@@ -354,14 +414,6 @@ class DNSForwarder:
         response.set_rcode(dns.rcode.SERVFAIL)
         return response
 
-    def make_NXDOMAIN_response(self, query: dns.message.Message) -> dns.message.Message:
-        """
-        Make NXDOMAIN response for those are blocked
-        """
-        resp = dns.message.make_response(query)
-        resp.set_rcode(dns.rcode.NXDOMAIN)
-        return resp
-
     ######################### function to be called externally ###############
     def add_static_cache(self, statics: List[Dict]):
         """
@@ -374,6 +426,8 @@ class DNSForwarder:
                 domain = static.get("domain")
                 if not domain:
                     raise ValueError
+                # keyed the way handle_request looks queries up
+                domain = sys.intern(domain.lower())
 
                 query = dns.message.make_query(domain, dns.rdatatype.A)
                 resp = dns.message.make_response(query)
@@ -382,13 +436,31 @@ class DNSForwarder:
                     domain + ".", 3600, "IN", "A", static["address"]
                 )
                 resp.answer.append(rrset)
-                self._add_cache(domain, dns.rdatatype.A, resp, self.MAX_DNS_TTL)
+                self.static_cache[(domain, dns.rdatatype.A)] = resp.to_wire()
 
                 logger.debug(f"Static cache: {static}")
         except Exception as e:
             # TODO: what to catch here?
             logger.error(f"Error adding statics: {repr(e)}")
 
+    def get_cached(self, key: Tuple[str, int]) -> Optional[bytes]:
+        """
+        Wire form of the cached response for key (qname, qtype), static records
+        included, None if there's no valid one
+        """
+        wire = self.static_cache.get(key)
+        if wire is None:
+            wire = self._cache_get(self.cache, key)
+        return wire
+
+    def invalidate_cache(self, key: Tuple[str, int]) -> bool:
+        """
+        Drop the cached response for key (qname, qtype), static or not.
+        Return value indicates if it was present
+        """
+        static = self.static_cache.pop(key, None)
+        return self.cache.pop(key, None) is not None or static is not None
+
     def build_domain_trie(self, rules: List[Dict]):
         """
         Populate the domian trie with rules
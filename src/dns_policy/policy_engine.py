@@ -132,13 +132,13 @@ class PolicyEngine:
         try:
             # check if ip is still valid, if there's no cache, it means that
             # the rule is not currently depolyed
-            cached = self.forwarder.cache.get((domain, dns.rdatatype.A), None)
+            cached = self.forwarder.get_cached((domain, dns.rdatatype.A))
             if not cached or not self.nb_api_client:
                 logger.debug("No cache found...")
                 return
 
             # extract ip
-            resp = dns.message.from_wire(cached[0].to_wire())
+            resp = dns.message.from_wire(cached)
             ips = self.forwarder._extract_A_records(resp)
 
             result = None
@@ -47,7 +47,7 @@ class PolicyService:
         Lookup the domain in the domain trie for rules,
         and return the rules.
         """
-        return self.forwarder.domain_trie.lookup(domain)[0]
+        return self.forwarder.domain_trie.lookup(domain.lower())[0]
 
     async def add_rule(self, directive: str, domain: str, value: str = "") -> bool:
         """
@@ -71,6 +71,9 @@ class PolicyService:
             )
             return False
 
+        # dns names are case-insensitive, queries are looked up lower-cased
+        domain = domain.lower()
+
         # Create rule dict based on type
         rule = self._create_rule_dict(directive, domain, value)
 
@@ -99,12 +102,13 @@ class PolicyService:
         """
         # if directive is static, invalidate the cache is only move needed
         try:
+            domain = domain.lower()
             # Find and remove rule from trie
             found = await self.forwarder.domain_trie.cow_remove(domain, directive)
 
             # If found in trie, also remove from config manager
             if found:
-                await self._invalidate_cache(domain)
+                self._invalidate_cache(domain)
 
             return found
 
@@ -130,6 +134,8 @@ class PolicyService:
         Re-Builds the trie with all the rules provided
         """
         try:
+            # lower-cased like the rules from the config files
+            rules = [{**rule, "domain": rule["domain"].lower()} for rule in rules]
             self.forwarder.domain_trie.purge_trie()
             self.forwarder.build_domain_trie(rules)
             # self.forwarder.domain_trie.pretty_print()
@@ -190,7 +196,7 @@ class PolicyService:
     def _invalidate_cache(self, domain: str) -> bool:
         """
         This function tries to invalidate immediately a cache entry, if it's present
-        Ignores the exception for when the entry is not present in the cache, not need to use lock
+        Entries that are not present in the cache are ignored, not need to use lock
 
         Note: if this domain is a wildcard domain, then the existing cache that was matched by an
                 wildcard rule, will still be in effect until the ttl expires
@@ -198,13 +204,12 @@ class PolicyService:
         Return value: this return value indicates if a specific domain was present
         """
         # logger.debug(f"Removing an entry from the cache: {domain}")
+        domain = domain.lower()
 
-        try:
-            self.forwarder.cache.pop((domain, dns.rdatatype.A))
+        if self.forwarder.invalidate_cache((domain, dns.rdatatype.A)):
             logger.debug(f"{(domain, dns.rdatatype.A)} is removed successfully")
             return True
-        except KeyError:
-            return False
+        return False
 
     def _is_valid_domain(self, domain: str):
         """
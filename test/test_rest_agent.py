@@ -0,0 +1,71 @@
+import unittest
+import sys
+import os
+
+sys.path.insert(
+    0, os.path.abspath(os.path.join(os.path.dirname(__file__), "../src/agent"))
+)
+
+from pyroute2.netlink.exceptions import NetlinkError
+
+from rest_agent import AsyncRouteManager
+
+
+class FakeIPRoute:
+    """Keeps routes as (dst, table, priority) like the kernel matches them"""
+
+    def __init__(self):
+        self.installed = {}
+
+    async def route(self, command, **params):
+        dst, table = params["dst"], params["table"]
+        priority = params.get("priority")
+        if command == "add":
+            self.installed[(dst, table, priority)] = params["gateway"]
+        elif command == "replace":
+            self.installed[(dst, table, priority)] = params["gateway"]
+        elif command == "del":
+            for key in self.installed:
+                if key[:2] == (dst, table) and priority in (None, key[2]):
+                    del self.installed[key]
+                    return
+            raise NetlinkError(3, "No such process")
+
+
+class UpdateRouteTest(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.manager = AsyncRouteManager()
+        self.manager._aipr = FakeIPRoute()
+
+    async def test_update_changes_table(self):
+        await self.manager.add_route("10.9.0.0/24", "10.0.0.2")
+        success, msg = await self.manager.add_route(
+            "10.9.0.0/24", "10.0.0.3", table=100
+        )
+        self.assertTrue(success, msg)
+        self.assertEqual(
+            self.manager._aipr.installed, {("10.9.0.0/24", 100, None): "10.0.0.3"}
+        )
+        self.assertEqual(self.manager.routes["10.9.0.0/24"].table, 100)
+
+    async def test_update_changes_metric(self):
+        await self.manager.add_route("10.9.0.0/24", "10.0.0.2", metric=10)
+        success, msg = await self.manager.add_route(
+            "10.9.0.0/24", "10.0.0.3", metric=20
+        )
+        self.assertTrue(success, msg)
+        self.assertEqual(
+            self.manager._aipr.installed, {("10.9.0.0/24", 254, 20): "10.0.0.3"}
+        )
+
+    async def test_update_replaces_nexthop(self):
+        await self.manager.add_route("10.9.0.0/24", "10.0.0.2")
+        success, msg = await self.manager.add_route("10.9.0.0/24", "10.0.0.3")
+        self.assertTrue(success, msg)
+        self.assertEqual(
+            self.manager._aipr.installed, {("10.9.0.0/24", 254, None): "10.0.0.3"}
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()